@@ -0,0 +1,106 @@
+"""
+Closed-loop output power control with an Attenuator and a reference PowerMeter.
+Attenuator.set_pset() relies on the attenuator's own power calibration, which drifts.  Here the
+power is read on the reference meter instead and the attenuation is corrected until the reading is
+within tolerance.  Power at the meter is modelled as intercept - slope * attenuation; the model is
+learned per wavelength, so the first step of later setpoints usually lands within tolerance.
+
+Example:
+    control = PowerController(attenuator, 2, 0, meter, 3)
+    result = control.set_power(-20, tolerance=0.02)
+    print(result.power, result.reads)
+"""
+
+import time
+from collections import namedtuple
+from Instruments import IO_CONTROL, IOScheduler
+
+PowerControlResult = namedtuple("PowerControlResult", ["attenuation", "power", "reads", "converged"])
+
+
+class PowerController:
+    """
+    attenuator/chassis/slot locate the attenuator (chassis is only used by EXFO, see Attenuator),
+    meter/meter_slot/meter_channel the reference power meter reading in dBm.
+    damping scales every correction after the first step, settle_time (s) is the wait after each
+    attenuation change.
+    """
+
+    def __init__(self, attenuator, chassis, slot, meter, meter_slot, meter_channel=1,
+                 damping=0.8, settle_time=0.2, min_attenuation=0, max_attenuation=60):
+        self.attenuator = attenuator
+        self.chassis = chassis
+        self.slot = slot
+        self.meter = meter
+        self.meter_slot = meter_slot
+        self.meter_channel = meter_channel
+        self.damping = damping
+        self.settle_time = settle_time
+        self.min_attenuation = min_attenuation
+        self.max_attenuation = max_attenuation
+        self.models = {}    # wavelength (nm, 0.1 nm steps): [intercept, slope]
+
+    def read_power(self):
+        return float(self.meter.get_power(self.meter_slot, self.meter_channel))
+
+    def set_attenuation(self, attenuation):
+        attenuation = round(min(max(attenuation, self.min_attenuation), self.max_attenuation), 3)
+        self.attenuator.set_attenuation(self.chassis, self.slot, attenuation)
+        time.sleep(self.settle_time)
+        return attenuation
+
+    def model_key(self, wavelength):
+        if wavelength is None:
+            wavelength = float(self.attenuator.get_wavelength(self.chassis, self.slot)) * 1e9
+        return round(float(wavelength), 1)
+
+    @IOScheduler.priority(IO_CONTROL)
+    def set_power(self, target, tolerance=0.05, max_reads=6, wavelength=None):
+        """
+        Reaches target dBm at the meter.  wavelength (nm) selects the learned model; when omitted
+        it is read from the attenuator.  Returns a PowerControlResult.
+        """
+        key = self.model_key(wavelength)
+        reads = 0
+        if key in self.models:
+            intercept, slope = self.models[key]
+        else:
+            # No model yet: one read at the present attenuation, unit slope
+            attenuation = float(self.attenuator.get_attenuation(self.chassis, self.slot))
+            power = self.read_power()
+            reads += 1
+            slope = 1.0
+            intercept = power + slope * attenuation
+            if abs(power - target) <= tolerance:
+                self.models[key] = [intercept, slope]
+                return PowerControlResult(attenuation, power, reads, True)
+
+        # Model-based first step, then damped corrections
+        attenuation = self.set_attenuation((intercept - target) / slope)
+        gain = 1.0
+        while True:
+            power = self.read_power()
+            reads += 1
+            error = power - target
+            if abs(error) <= tolerance or reads >= max_reads:
+                break
+            next_attenuation = self.set_attenuation(attenuation + gain * error / slope)
+            if next_attenuation == attenuation:
+                break
+            gain = self.damping
+            # Learn the slope from this step when it is large enough to trust
+            next_power = self.read_power()
+            reads += 1
+            step = next_attenuation - attenuation
+            if abs(step) >= 0.1:
+                measured_slope = (power - next_power) / step
+                if 0.5 < measured_slope < 2:
+                    slope = measured_slope
+            attenuation = next_attenuation
+            power = next_power
+            error = power - target
+            if abs(error) <= tolerance or reads >= max_reads:
+                break
+            attenuation = self.set_attenuation(attenuation + gain * error / slope)
+        self.models[key] = [power + slope * attenuation, slope]
+        return PowerControlResult(attenuation, power, reads, abs(power - target) <= tolerance)
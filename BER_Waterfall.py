@@ -0,0 +1,167 @@
+"""
+BER waterfall (BER versus received power) with an Attenuator, a reference PowerMeter and the BERT.
+Received power is set in closed loop with Attenuator_Control.PowerController.  Instead of a fixed
+power grid and a fixed dwell, every BER is converted to Q (BER = erfc(Q / sqrt(2)) / 2), which is
+close to linear in received power (dBm), and a weighted line is fitted as points come in.  The
+next point is placed where the fit predicts a Q near the threshold, and each point dwells only
+until it has min_errors errors or has proven BER < threshold_ber.
+
+Example:
+    waterfall = BERWaterfall(attenuator, 2, 0, meter, 3, bert, threshold_ber=2.4e-4)
+    result = waterfall.run(-14, -6)
+    print(result.sensitivity)
+"""
+
+import math
+import time
+from collections import namedtuple
+from statistics import NormalDist
+from Attenuator_Control import PowerController
+from Instruments import IO_CONTROL, IOScheduler
+
+WaterfallPoint = namedtuple("WaterfallPoint", ["power", "attenuation", "bits", "errors", "ber", "ber_upper",
+                                               "verdict", "duration"])
+WaterfallResult = namedtuple("WaterfallResult", ["points", "sensitivity", "slope", "intercept", "duration"])
+
+
+def ber_to_q(ber):
+    return -NormalDist().inv_cdf(ber)
+
+
+def q_to_ber(q):
+    return 0.5 * math.erfc(q / math.sqrt(2))
+
+
+class QFit:
+    """
+    Weighted least-squares line Q = intercept + slope * power, updated one point at a time.
+    """
+
+    def __init__(self):
+        self.weight = 0.0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.count = 0
+
+    def add(self, power, q, weight=1.0):
+        self.count += 1
+        self.weight += weight
+        self.sum_x += weight * power
+        self.sum_y += weight * q
+        self.sum_xx += weight * power * power
+        self.sum_xy += weight * power * q
+
+    def line(self):
+        """
+        (slope, intercept), or None with fewer than two distinct powers.
+        """
+        denominator = self.weight * self.sum_xx - self.sum_x ** 2
+        if self.count < 2 or denominator <= 1e-12 * self.weight ** 2:
+            return None
+        slope = (self.weight * self.sum_xy - self.sum_x * self.sum_y) / denominator
+        return slope, (self.sum_y - slope * self.sum_x) / self.weight
+
+    def power_at(self, q):
+        line = self.line()
+        if line is None or line[0] <= 0:
+            return None
+        slope, intercept = line
+        return (q - intercept) / slope
+
+
+class BERWaterfall:
+    """
+    attenuator/chassis/slot and meter/meter_slot/meter_channel are passed to PowerController.
+    tap_offset (dB) is added to the meter reading to get the power at the receiver.
+    q_offsets are the Q values, relative to the threshold Q, at which points are placed.
+    """
+
+    def __init__(self, attenuator, chassis, slot, meter, meter_slot, bert, meter_channel=1,
+                 location="M1.DataIn1", threshold_ber=1e-12, confidence=0.95, tap_offset=0,
+                 q_offsets=(-1.5, -1.0, -0.5, 0.0, 0.25), min_errors=10, min_spacing=0.1,
+                 point_timeout=600, min_interval=0.2, max_interval=10):
+        self.controller = PowerController(attenuator, chassis, slot, meter, meter_slot, meter_channel)
+        self.bert = bert
+        self.location = location
+        self.threshold_ber = threshold_ber
+        self.confidence = confidence
+        self.tap_offset = tap_offset
+        self.q_offsets = q_offsets
+        self.min_errors = min_errors
+        self.min_spacing = min_spacing
+        self.point_timeout = point_timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.points = []
+        self.fit = QFit()
+
+    @IOScheduler.priority(IO_CONTROL)
+    def dwell(self):
+        """
+        Counts errors until there are min_errors of them, BER < threshold_ber is proven or
+        point_timeout (s) runs out, using BERT.measure_ber().  Returns a BerResult.
+        """
+        results = self.bert.measure_ber(self.threshold_ber, self.confidence, locations=(self.location,),
+                                        timeout=self.point_timeout, min_interval=self.min_interval,
+                                        max_interval=self.max_interval, min_errors=self.min_errors)
+        return results[self.location]
+
+    def measure(self, power):
+        """
+        Sets the received power (dBm), measures the BER and adds the point to the fit.
+        """
+        control = self.controller.set_power(power - self.tap_offset)
+        ber = self.dwell()
+        point = WaterfallPoint(control.power + self.tap_offset, control.attenuation, *ber)
+        self.points.append(point)
+        if 0 < point.errors and point.ber < 0.5:
+            self.fit.add(point.power, ber_to_q(point.ber), point.errors)
+        return point
+
+    def next_power(self, low, high):
+        """
+        Next received power to measure in [low, high], or None when every target is covered.
+        """
+        measured = [point.power for point in self.points]
+        candidates = []
+        if self.fit.power_at(0) is not None:
+            threshold_q = ber_to_q(self.threshold_ber)
+            candidates = [self.fit.power_at(threshold_q + offset) for offset in self.q_offsets]
+        else:
+            # Not enough erroneous points for a line yet: bisect between the errored and clean powers
+            errored = [point.power for point in self.points if point.errors > 0]
+            clean = [point.power for point in self.points if point.errors == 0]
+            if errored:
+                candidates = [(max(errored) + min(clean + [high])) / 2]
+                if not clean:
+                    candidates.append(high)
+        for power in candidates:
+            power = min(max(power, low), high)
+            if all(abs(power - other) >= self.min_spacing for other in measured):
+                return power
+        return None
+
+    @IOScheduler.priority(IO_CONTROL)
+    def run(self, low, high, max_points=12):
+        """
+        Measures the waterfall between low and high received power (dBm), starting at low where
+        errors come fastest.  Returns a WaterfallResult with the points sorted by power and the
+        fitted sensitivity (received power at threshold_ber), nan if no line could be fitted.
+        """
+        start = time.monotonic()
+        self.points = []
+        self.fit = QFit()
+        power = low
+        while power is not None and len(self.points) < max_points:
+            self.measure(power)
+            power = self.next_power(low, high)
+        line = self.fit.line()
+        slope, intercept = line if line is not None else (math.nan, math.nan)
+        sensitivity = self.fit.power_at(ber_to_q(self.threshold_ber))
+        return WaterfallResult(points=sorted(self.points),
+                               sensitivity=math.nan if sensitivity is None else sensitivity,
+                               slope=slope,
+                               intercept=intercept,
+                               duration=time.monotonic() - start)
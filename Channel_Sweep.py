@@ -0,0 +1,79 @@
+"""
+ITU channel sweep pipeline for the OSNR generator and the OSA.
+For every channel the generator is tuned, the OSA is centred on the channel and swept once, and
+the trace is analysed with OSA_Analysis.dwdm_grid_analysis().  The steps overlap: while the OSA
+sweeps channel N, a worker thread analyses the trace of channel N-1 and the settings of channel
+N+1 are staged.  The trace is read only after OSA.wait_for_sweep() sees the sweep finish, and the
+staged settings are applied right after trace N has been read.
+All channels end up in one CHANNEL_SWEEP_DTYPE table: the OSA_Analysis.DWDM_TABLE_DTYPE fields,
+with channel holding the ITU number as a float so half channels (35.5) are kept.
+
+Example:
+    sweep = ChannelSweep(osnr, osa)
+    table = sweep.run(range(20, 61))
+    print(table[["channel", "power", "osnr"]])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np   # pip install numpy
+from OSA_Analysis import DWDM_TABLE_DTYPE, SPEED_OF_LIGHT, dwdm_grid_analysis, itu_channel_frequency
+
+CHANNEL_SWEEP_DTYPE = np.dtype([(name, "f8" if name == "channel" else DWDM_TABLE_DTYPE[name])
+                                for name in DWDM_TABLE_DTYPE.names])
+
+
+class ChannelSweep:
+    """
+    The trace is read once OSA.wait_for_sweep() reports the sweep finished, within sweep_timeout (s).
+    span (nm) is applied once at the start if given.  threshold (dBm) is the channel detection level.
+    """
+
+    def __init__(self, osnr, osa, sweep_timeout=60, span=None, threshold=-50):
+        self.osnr = osnr
+        self.osa = osa
+        self.sweep_timeout = sweep_timeout
+        self.span = span
+        self.threshold = threshold
+
+    def stage(self, itu_channel):
+        frequency = float(itu_channel_frequency(itu_channel))
+        return {"channel": itu_channel,
+                "frequency": frequency,
+                "center": f"{SPEED_OF_LIGHT / frequency:.3f}"}
+
+    def apply(self, staged):
+        self.osnr.set_itu_channel(staged["channel"])
+        self.osa.set_center(staged["center"])
+
+    def analyse(self, staged, wavelength, amplitude, resolution, noise_bw):
+        analysed = dwdm_grid_analysis(wavelength, amplitude, [staged["frequency"]], resolution, noise_bw, self.threshold)
+        row = np.zeros(1, dtype=CHANNEL_SWEEP_DTYPE)
+        for name in DWDM_TABLE_DTYPE.names:
+            row[name] = analysed[name]
+        row["channel"] = staged["channel"]
+        return row
+
+    def run(self, channels):
+        channels = list(channels)
+        if not channels:
+            return np.zeros(0, dtype=CHANNEL_SWEEP_DTYPE)
+        if self.span is not None:
+            self.osa.set_span(self.span)
+        resolution = float(self.osa.get_resolution())
+        noise_bw = float(self.osa.get_noise_bw())
+        rows = []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            staged = self.stage(channels[0])
+            self.apply(staged)
+            for i in range(len(channels)):
+                self.osa.single_sweep()
+                # Stage the next channel while the OSA sweeps (analysis of the previous one runs in the worker)
+                next_staged = self.stage(channels[i + 1]) if i + 1 < len(channels) else None
+                self.osa.wait_for_sweep(self.sweep_timeout)
+                wavelength, amplitude = self.osa.get_trace()
+                if next_staged is not None:
+                    self.apply(next_staged)
+                rows.append(executor.submit(self.analyse, staged, wavelength, amplitude, resolution, noise_bw))
+                staged = next_staged
+            table = np.concatenate([row.result() for row in rows])
+        return table
@@ -0,0 +1,118 @@
+"""
+Clock accuracy measurement combining the Frequency_Counter and the Oscilloscope CDR.
+To install numpy library, run 'pip install numpy' in command prompt or terminal
+The counter measures the scope's recovered clock output, which runs at the data rate divided by
+Oscilloscope.get_CDR_ratio().  The CDR ratio is read on a worker thread while the counter streams
+readings, and the measurement stops as soon as the confidence interval of the ppm offset is
+within target.
+
+Example:
+    clock = ClockAccuracy(counter, scope, nominal_rate=25.78125e9)
+    result = clock.measure(max_samples=5000, target_ci=0.05)
+    print(result.ppm, result.ppm_ci, result.drift)
+"""
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
+import numpy as np   # pip install numpy
+from Instruments import IO_CONTROL, IOScheduler
+
+ClockAccuracyResult = namedtuple("ClockAccuracyResult", ["frequency", "expected_frequency", "ppm", "ppm_ci",
+                                                         "ppm_std", "drift", "taus", "allan_deviation",
+                                                         "samples", "cdr_ratio", "stopped_early", "duration"])
+
+
+def ppm_offset(frequency, expected_frequency):
+    return (np.asarray(frequency, dtype=float) - expected_frequency) / expected_frequency * 1e6
+
+
+def drift(ppm, sample_interval):
+    """
+    Least-squares slope of the ppm offset over time, in ppm/s.
+    """
+    ppm = np.asarray(ppm, dtype=float)
+    if len(ppm) < 2:
+        return np.nan
+    elapsed = np.arange(len(ppm)) * sample_interval
+    return np.polyfit(elapsed, ppm, 1)[0]
+
+
+def allan_deviation(fractional_frequency, tau0, taus=None):
+    """
+    Overlapping Allan deviation of fractional frequency samples taken every tau0 seconds.
+    taus defaults to octave spacing up to a third of the record.  Returns (taus, deviations).
+    """
+    y = np.asarray(fractional_frequency, dtype=float)
+    phase = np.concatenate(([0], np.cumsum(y))) * tau0
+    n = len(phase)
+    if taus is None:
+        averaging = 2 ** np.arange(int(np.log2(max(n // 3, 1))) + 1)
+    else:
+        averaging = np.unique(np.maximum(np.round(np.asarray(taus) / tau0).astype(int), 1))
+    averaging = averaging[2 * averaging < n]
+    deviations = np.empty(len(averaging))
+    for i, m in enumerate(averaging):
+        second_difference = phase[2 * m:] - 2 * phase[m:-m] + phase[:-2 * m]
+        deviations[i] = np.sqrt(np.mean(second_difference ** 2) / (2 * (m * tau0) ** 2))
+    return averaging * tau0, deviations
+
+
+class ClockAccuracy:
+    """
+    counter is a Frequency_Counter measuring the clock output of scope (an Oscilloscope).
+    nominal_rate is the expected data rate (Hz).  sample_interval (s) is the time between counter
+    readings, i.e. its gate time.
+    """
+
+    def __init__(self, counter, scope, nominal_rate, input=3, CDR_channel=5, sample_interval=0.1):
+        self.counter = counter
+        self.scope = scope
+        self.nominal_rate = nominal_rate
+        self.input = input
+        self.CDR_channel = CDR_channel
+        self.sample_interval = sample_interval
+
+    @IOScheduler.priority(IO_CONTROL)
+    def measure(self, max_samples=10000, target_ci=None, confidence=0.95, min_samples=30):
+        """
+        Streams up to max_samples counter readings.  With target_ci (ppm) the measurement stops
+        once the confidence interval half-width of the mean ppm offset is at or below it.
+        """
+        start = time.monotonic()
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # The worker thread does not inherit this thread's I/O priority
+            cdr_future = executor.submit(IOScheduler.priority(IO_CONTROL)(self.scope.get_CDR_ratio), self.CDR_channel)
+            stop = {"early": False}
+
+            def check_confidence(block, statistics):
+                if target_ci is None or statistics.count < min_samples or not cdr_future.done():
+                    return False
+                expected = self.nominal_rate / float(cdr_future.result())
+                half_width = z * statistics.std() / np.sqrt(statistics.count) / expected * 1e6
+                stop["early"] = half_width <= target_ci
+                return stop["early"]
+
+            frequency = self.counter.get_frequency_block(max_samples, self.input, self.sample_interval,
+                                                         callback=check_confidence,
+                                                         timeout=max_samples * self.sample_interval * 1.5 + 30)
+            cdr_ratio = float(cdr_future.result())
+
+        expected = self.nominal_rate / cdr_ratio
+        ppm = ppm_offset(frequency, expected)
+        ppm_std = ppm.std(ddof=1) if len(ppm) > 1 else np.nan
+        taus, deviations = allan_deviation(frequency / expected - 1, self.sample_interval)
+        return ClockAccuracyResult(frequency=frequency.mean(),
+                                   expected_frequency=expected,
+                                   ppm=ppm.mean(),
+                                   ppm_ci=z * ppm_std / np.sqrt(len(ppm)),
+                                   ppm_std=ppm_std,
+                                   drift=drift(ppm, self.sample_interval),
+                                   taus=taus,
+                                   allan_deviation=deviations,
+                                   samples=len(ppm),
+                                   cdr_ratio=cdr_ratio,
+                                   stopped_early=stop["early"],
+                                   duration=time.monotonic() - start)
@@ -0,0 +1,141 @@
+"""
+Host-side eye-diagram analysis of captured waveforms.
+To install numpy library, run 'pip install numpy' in command prompt or terminal
+Waveforms come from Oscilloscope.get_waveform() and are folded on the unit interval of the
+recovered clock (Oscilloscope.get_unit_interval()).  The eye is kept as a 2-D histogram
+(phase x level) that grows with every update(), so metrics can be recomputed at any time and
+over different windows without re-acquiring.
+
+Example:
+    eye = EyeDiagram(scope.get_unit_interval())
+    for i in range(10):
+        time_axis, volts = scope.get_waveform(channel=1)
+        eye.update(time_axis, volts)
+    print(eye.metrics())
+"""
+
+import numpy as np   # pip install numpy
+
+
+class EyeDiagram:
+    """
+    phase_bins bins span one unit interval, level_bins bins span level_range (V).
+    level_range defaults to the first update's range plus 10% margin; later samples outside it
+    are clipped into the edge bins.
+    """
+
+    def __init__(self, unit_interval, phase_bins=128, level_bins=256, level_range=None, phase_offset=0):
+        self.unit_interval = unit_interval
+        self.phase_bins = phase_bins
+        self.level_bins = level_bins
+        self.level_range = level_range
+        self.phase_offset = phase_offset
+        self.histogram = np.zeros((phase_bins, level_bins), dtype=np.int64)
+
+    def update(self, time_axis, volts):
+        time_axis = np.asarray(time_axis, dtype=float)
+        volts = np.asarray(volts, dtype=float)
+        valid = np.isfinite(volts)
+        time_axis = time_axis[valid]
+        volts = volts[valid]
+        if self.level_range is None:
+            margin = (volts.max() - volts.min()) * 0.1
+            self.level_range = (volts.min() - margin, volts.max() + margin)
+        phase = np.mod(time_axis / self.unit_interval - self.phase_offset, 1)
+        phase_index = np.minimum((phase * self.phase_bins).astype(int), self.phase_bins - 1)
+        low, high = self.level_range
+        level_index = np.clip(((volts - low) / (high - low) * self.level_bins).astype(int), 0, self.level_bins - 1)
+        counts = np.bincount(phase_index * self.level_bins + level_index, minlength=self.phase_bins * self.level_bins)
+        self.histogram += counts.reshape(self.phase_bins, self.level_bins)
+        return self.histogram
+
+    def reset(self):
+        self.histogram[:] = 0
+
+    def level_centers(self):
+        low, high = self.level_range
+        return low + (np.arange(self.level_bins) + 0.5) * (high - low) / self.level_bins
+
+    def crossing_phase(self):
+        """
+        Phase (UI) of the eye crossing: the phase column with most samples in the middle 40-60% of the levels.
+        """
+        middle = self.level_bins * 2 // 5, self.level_bins * 3 // 5
+        column = self.histogram[:, middle[0]:middle[1]].sum(axis=1)
+        return (np.argmax(column) + 0.5) / self.phase_bins
+
+    def metrics(self, center_window=0.2, dark_level=0):
+        """
+        Eye height (V), eye width (UI), crossing percentage and extinction ratio (dB).
+        Levels are taken in the center_window (UI) around the eye center.  Widths and heights use
+        mean -/+ 3 sigma of the levels and crossing times.  dark_level is the scope's dark
+        (no light) level, subtracted before the extinction ratio.
+        """
+        levels = self.level_centers()
+        crossing = self.crossing_phase()
+        phase = (np.arange(self.phase_bins) + 0.5) / self.phase_bins
+        relative_phase = np.mod(phase - crossing + 0.5, 1) - 0.5
+        center = np.abs(relative_phase) >= 0.5 - center_window / 2
+
+        # Threshold the center-of-eye level distribution into the one and zero rails
+        center_counts = self.histogram[center].sum(axis=0)
+        if center_counts.sum() == 0:
+            return None
+        threshold = np.average(levels, weights=center_counts)
+        one = levels >= threshold
+        one_counts = np.where(one, center_counts, 0)
+        zero_counts = np.where(one, 0, center_counts)
+        if one_counts.sum() == 0 or zero_counts.sum() == 0:
+            return None
+        one_level = np.average(levels, weights=one_counts)
+        zero_level = np.average(levels, weights=zero_counts)
+        one_sigma = np.sqrt(np.average((levels - one_level) ** 2, weights=one_counts))
+        zero_sigma = np.sqrt(np.average((levels - zero_level) ** 2, weights=zero_counts))
+        amplitude = one_level - zero_level
+
+        # Crossing level and timing jitter from samples in the transition band
+        band = (levels > zero_level + 3 * zero_sigma) & (levels < one_level - 3 * one_sigma)
+        near_crossing = np.abs(relative_phase) < 0.5 - center_window / 2
+        transitions = self.histogram[near_crossing][:, band]
+        if transitions.sum() > 0:
+            crossing_level = np.average(levels[band], weights=transitions.sum(axis=0))
+            # Timing spread is taken in a thin slice at the crossing level so the edge slope does not count
+            at_crossing = np.abs(levels - crossing_level) < 0.05 * amplitude
+            crossing_time = relative_phase[near_crossing]
+            time_counts = self.histogram[near_crossing][:, at_crossing].sum(axis=1)
+            mean_time = np.average(crossing_time, weights=time_counts)
+            time_sigma = np.sqrt(np.average((crossing_time - mean_time) ** 2, weights=time_counts))
+        else:
+            crossing_level = (one_level + zero_level) / 2
+            time_sigma = 0.0
+
+        one_power = one_level - dark_level
+        zero_power = zero_level - dark_level
+        if zero_power > 0:
+            extinction_ratio = 10 * np.log10(one_power / zero_power)
+        else:
+            extinction_ratio = np.inf
+
+        return {"one_level": one_level,
+                "zero_level": zero_level,
+                "eye_amplitude": amplitude,
+                "eye_height": (one_level - 3 * one_sigma) - (zero_level + 3 * zero_sigma),
+                "eye_width": 1 - 6 * time_sigma,
+                "crossing_percentage": 100 * (crossing_level - zero_level) / amplitude,
+                "extinction_ratio": extinction_ratio}
+
+
+def eye_metrics(time_axis, volts, unit_interval, start=None, stop=None, **kwargs):
+    """
+    Metrics over the part of an already captured waveform between start and stop (s).
+    Remaining keyword arguments go to EyeDiagram().
+    """
+    time_axis = np.asarray(time_axis, dtype=float)
+    window = np.ones(len(time_axis), dtype=bool)
+    if start is not None:
+        window &= time_axis >= start
+    if stop is not None:
+        window &= time_axis < stop
+    eye = EyeDiagram(unit_interval, **kwargs)
+    eye.update(time_axis[window], np.asarray(volts, dtype=float)[window])
+    return eye.metrics()
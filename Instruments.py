@@ -22,13 +22,17 @@ Current Support List:
 
 """
 
-from PIL import Image   # pip install pillow
 import pyvisa
 import time
 import math
 import matplotlib.pyplot as plt
 import os
-import io
+import threading
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np   # pip install numpy
+from OSA_Analysis import dwdm_grid_analysis
 
 LIGHTWAVE_MULTIMETER_IDNS = ["8163A", "8163B"]
 LIGHTWAVE_MEASURMENT_SYSTEM_IDNS = ["8164A", "8164B"]
@@ -43,6 +47,217 @@ TUNABLE_LASER_SOURCE_IDNS = ["81600B", "81606A", "81607A",
 REFERENCE_TRANSMITTER_IDNS = ["81490A", "81490B"]
 
 
+# I/O priority classes for IOScheduler, lower numbers are served first
+IO_INTERACTIVE = 0      # operator actions from the GUIs and scripts
+IO_CONTROL = 1          # closed-loop control (power, OSNR, ...)
+IO_MONITORING = 2       # background polling
+
+
+class IOScheduler:
+    """
+    Serialises the I/O of every Instrument session on one bus: a GPIB board is shared by all of
+    its instruments, a TCP/IP or other resource is a bus of its own.
+    Waiting operations are served by priority class (IO_INTERACTIVE, IO_CONTROL, IO_MONITORING),
+    round-robin between sessions within a class.  An operation waiting longer than max_wait (s) is
+    served first whatever its class, so polling is delayed but never starved.
+    A query identical to one the same session already has waiting shares its reply instead of
+    being sent again.
+    The priority of the calling thread is set with IOScheduler.priority(level), as a context
+    manager or a decorator; threads that do not set it use the session's default
+    (Instrument.io_priority).  The closed-loop modules (Attenuator_Control, OSNR_Control,
+    BER_Waterfall, Clock_Accuracy) run at IO_CONTROL and the wait_for_* status polls at
+    IO_MONITORING; GUI button handlers stay IO_INTERACTIVE.
+    Scheduling is per process: sessions in separate processes (e.g. standalone GUIs started on
+    their own) are not coordinated with each other.  OSA_GUI.py keeps its own pyvisa-based OSA
+    class and does not go through the scheduler.
+    """
+
+    schedulers = {}
+    registry_lock = threading.Lock()
+    local = threading.local()
+
+    class Ticket:
+        def __init__(self, session, priority, key):
+            self.session = session
+            self.priority = priority
+            self.key = key
+            self.queued = time.monotonic()
+            self.finished = False
+            self.result = None
+            self.error = None
+
+    def __init__(self, bus, max_wait=2.0):
+        self.bus = bus
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.queues = [OrderedDict() for level in (IO_INTERACTIVE, IO_CONTROL, IO_MONITORING)]
+        self.pending_reads = {}     # (session, command): waiting ticket
+        self.last_ticket = {}       # session: most recently queued ticket
+        self.granted = None
+        self.owner = None
+        self.depth = 0
+
+    @classmethod
+    def for_address(cls, address):
+        address = str(address)
+        bus = address.split("::")[0].upper() if address.upper().startswith("GPIB") else address
+        with cls.registry_lock:
+            if bus not in cls.schedulers:
+                cls.schedulers[bus] = cls(bus)
+            return cls.schedulers[bus]
+
+    @staticmethod
+    @contextmanager
+    def priority(level):
+        previous = getattr(IOScheduler.local, "priority", None)
+        IOScheduler.local.priority = level
+        try:
+            yield
+        finally:
+            IOScheduler.local.priority = previous
+
+    @staticmethod
+    def current_priority(default):
+        level = getattr(IOScheduler.local, "priority", None)
+        return default if level is None else level
+
+    def grant_next(self):
+        """
+        Picks the next ticket; called with the condition held and the bus free.
+        """
+        heads = [(queue[session][0], level, session)
+                 for level, queue in enumerate(self.queues) for session in queue]
+        if not heads:
+            self.granted = None
+            return
+        oldest = min(heads, key=lambda head: head[0].queued)
+        if time.monotonic() - oldest[0].queued > self.max_wait:
+            ticket, level, session = oldest
+        else:
+            ticket, level, session = next(head for head in heads if head[1] == heads[0][1])
+        queue = self.queues[level]
+        queue[session].popleft()
+        # Round-robin: the session goes to the back of its class
+        if queue[session]:
+            queue.move_to_end(session)
+        else:
+            del queue[session]
+        if ticket.key is not None and self.pending_reads.get((session, ticket.key)) is ticket:
+            del self.pending_reads[(session, ticket.key)]
+        self.granted = ticket
+        self.condition.notify_all()
+
+    def acquire(self, session, priority, key=None):
+        """
+        Waits for the bus.  Returns (ticket, True) once this thread owns it, or (ticket, False)
+        when the read was coalesced with a waiting one and ticket already holds the reply.
+        Re-entrant for the owning thread.
+        """
+        thread = threading.get_ident()
+        with self.condition:
+            if self.owner == thread:
+                self.depth += 1
+                return None, True
+            ticket = self.pending_reads.get((session, key)) if key is not None else None
+            if ticket is not None and self.last_ticket.get(session) is ticket:
+                while not ticket.finished:
+                    self.condition.wait()
+                return ticket, False
+            ticket = IOScheduler.Ticket(session, priority, key)
+            self.queues[priority].setdefault(session, deque()).append(ticket)
+            self.last_ticket[session] = ticket
+            if key is not None:
+                self.pending_reads[(session, key)] = ticket
+            if self.owner is None and self.granted is None:
+                self.grant_next()
+            while self.granted is not ticket:
+                self.condition.wait()
+            self.granted = None
+            self.owner = thread
+            self.depth = 1
+            return ticket, True
+
+    def release(self, ticket=None, result=None, error=None):
+        with self.condition:
+            self.depth -= 1
+            if self.depth:
+                return
+            if ticket is not None:
+                ticket.result = result
+                ticket.error = error
+                ticket.finished = True
+                if self.last_ticket.get(ticket.session) is ticket:
+                    del self.last_ticket[ticket.session]
+            self.owner = None
+            self.grant_next()
+            self.condition.notify_all()
+
+    def call(self, session, priority, function, *args, key=None, **kwargs):
+        ticket, owner = self.acquire(session, priority, key)
+        if not owner:
+            if ticket.error is not None:
+                raise ticket.error
+            return ticket.result
+        result = error = None
+        try:
+            result = function(*args, **kwargs)
+            return result
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            self.release(ticket, result, error)
+
+    @contextmanager
+    def exclusive(self, session, priority):
+        """
+        Holds the bus for several operations, e.g. a write followed by a separate read.
+        """
+        ticket, owner = self.acquire(session, priority)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+
+class ScheduledResource:
+    """
+    Wraps a pyvisa resource so that its I/O goes through the IOScheduler of its bus.
+    Any other attribute (timeout, chunk_size, ...) is read from and written to the resource.
+    """
+
+    IO_METHODS = ("write", "read", "write_raw", "read_raw", "read_bytes", "query_binary_values",
+                  "query_ascii_values", "write_binary_values", "write_ascii_values", "clear",
+                  "assert_trigger", "read_stb", "close")
+
+    def __init__(self, resource, scheduler, priority=IO_INTERACTIVE):
+        self.__dict__["resource"] = resource
+        self.__dict__["scheduler"] = scheduler
+        self.__dict__["priority"] = priority
+
+    def __getattr__(self, name):
+        attribute = getattr(self.resource, name)
+        if name in ScheduledResource.IO_METHODS:
+            def scheduled(*args, **kwargs):
+                return self.scheduler.call(self, IOScheduler.current_priority(self.priority), attribute,
+                                           *args, **kwargs)
+            return scheduled
+        return attribute
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.resource, name, value)
+
+    def query(self, message, delay=None):
+        return self.scheduler.call(self, IOScheduler.current_priority(self.priority), self.resource.query,
+                                   message, delay, key=message)
+
+    def exclusive(self):
+        return self.scheduler.exclusive(self, IOScheduler.current_priority(self.priority))
+
+
 class Instrument:
 
     class ConnectionError(Exception):
@@ -51,9 +266,13 @@ class Instrument:
     class UnknownInstrumentError(Exception):
         pass
 
+    class TimeoutError(Exception):
+        pass
+
     def __init__(self, address=None, nickname="Instrument"):
         self.address = address
         self.nickname = nickname
+        self.io_priority = IO_INTERACTIVE
         self.instrument = None
         try:
             self.connect()
@@ -63,13 +282,27 @@ class Instrument:
 
     def connect(self):
         self.rm = pyvisa.ResourceManager()
-        self.instrument = self.rm.open_resource(self.address)
+        self.open_session()
         self.clear()
 
+    def open_session(self):
+        """
+        Opens the resource with its I/O routed through the bus's IOScheduler.
+        """
+        self.instrument = ScheduledResource(self.rm.open_resource(self.address),
+                                            IOScheduler.for_address(self.address), self.io_priority)
+
     def refresh_connection(self):
         if not self.instrument.query("*IDN?"):
             self.instrument.close()
-            self.instrument = self.rm.open_resource(self.address)
+            self.open_session()
+
+    def set_io_priority(self, level):
+        """
+        Default IOScheduler priority of this session, e.g. IO_MONITORING for an instrument that is only polled.
+        """
+        self.io_priority = level
+        self.instrument.priority = level
 
     def get_IDN(self):
         self.clear()
@@ -99,15 +332,24 @@ class Instrument:
         self.instrument.write("*RST")
 
 
+# Result of Attenuator.play_profile(), errors in seconds
+AttenuationProfileResult = namedtuple("AttenuationProfileResult", ["times", "actual", "error", "max_error",
+                                                                   "rms_error", "skipped"])
+
+
 class Attenuator(Instrument):
     """
     Compatible with EXFO and HP/Agilent/Keysight
     EXFO requires chassis number
     If attenuator is HP/Agilent/Keysight, chassis number is still needed for method input but will not be used.
+    Offsets are cached per (chassis, slot) for get_pset()/set_pset() on EXFO modules.  set_offset()
+    updates the cache, reset() clears it, and entries older than offset_max_age (s) are re-read.
     """
 
     def __init__(self, address=None, nickname="Attenuator"):
         super().__init__(address, nickname)
+        self.offset_max_age = 60
+        self.invalidate_offsets()
         if (self.get_IDN().replace(" ", "")[:4].upper() == "EXFO"):
             if self.get_IDN().split()[1].split("-")[1] == "3150":
                 self.type = "EXFO_module"
@@ -116,6 +358,13 @@ class Attenuator(Instrument):
         else:
             self.type = "HP"
 
+    def invalidate_offsets(self):
+        self.offsets = {}   # (chassis, slot): (offset, time read)
+
+    def reset(self):
+        super().reset()
+        self.invalidate_offsets()
+
     def get_attenuation(self, chassis, slot):
         if self.type == "EXFO_chassis":
             command = f"LINS00{chassis}{slot}:INP:RATT?"
@@ -132,14 +381,16 @@ class Attenuator(Instrument):
             response = str('{:.6E}'.format(float(response)*(-1)))
         return response.replace("\n", "").replace("\r", "")
 
-    def set_attenuation(self, chassis, slot, value):
+    def attenuation_command(self, chassis, slot, value):
         if self.type == "EXFO_chassis":
-            command = f"LINS00{chassis}{slot}:INP:RATT {value}"
+            return f"LINS00{chassis}{slot}:INP:RATT {value}"
         elif self.type == "EXFO_module":
-            command = f"INP:ATT {-1*value}"
+            return f"INP:ATT {-1*value}"
         else:
-            command = f"INP{slot}:ATT {value}"
-        self.instrument.write(command)
+            return f"INP{slot}:ATT {value}"
+
+    def set_attenuation(self, chassis, slot, value):
+        self.instrument.write(self.attenuation_command(chassis, slot, value))
 
     def get_offset(self, chassis, slot):
         if self.type == "EXFO_chassis":
@@ -155,7 +406,26 @@ class Attenuator(Instrument):
             response = self.instrument.query(command)
         if self.type == "EXFO_module":
             response = str('{:.6E}'.format(float(response)))
-        return response.replace("\n", "").replace("\r", "")
+        response = response.replace("\n", "").replace("\r", "")
+        if self.type == "EXFO_module":
+            self.offsets[(chassis, slot)] = (float(response), time.monotonic())
+        return response
+
+    def get_cached_offset(self, chassis, slot):
+        """
+        Offset from the cache, queried again if missing or older than offset_max_age.
+        """
+        cached = self.offsets.get((chassis, slot))
+        if cached is None or time.monotonic() - cached[1] > self.offset_max_age:
+            return float(self.get_offset(chassis, slot))
+        return cached[0]
+
+    def verify_offsets(self):
+        """
+        Re-reads every cached offset, e.g. after it may have been changed from the front panel.
+        """
+        for chassis, slot in list(self.offsets):
+            self.get_offset(chassis, slot)
 
     def set_offset(self, chassis, slot, value):
         if self.type == "EXFO_chassis":
@@ -165,6 +435,8 @@ class Attenuator(Instrument):
         else:
             command = f"INP{slot}:OFFS {value}"
         self.instrument.write(command)
+        if self.type == "EXFO_module":
+            self.offsets[(chassis, slot)] = (float(value), time.monotonic())
 
     def get_wavelength(self, chassis, slot):
         if self.type == "EXFO_chassis":
@@ -214,20 +486,43 @@ class Attenuator(Instrument):
         if self.type == "EXFO_chassis":
             response = str('{:.6E}'.format(float(response)*-1))
         elif self.type == "EXFO_module":
-            response = str('{:.6E}'.format(-1*((float(response)*-1) - float(self.get_offset(chassis, slot)))))
+            response = str('{:.6E}'.format(-1*((float(response)*-1) - self.get_cached_offset(chassis, slot))))
         return response.replace("\n", "").replace("\r", "")
 
     def set_pset(self, chassis, slot, value):
         if self.type == "EXFO_chassis":
             command = f"LINS00{chassis}{slot}:INP:ATT {-1*value}"
         elif self.type == "EXFO_module":
-            offset = float(self.get_offset(chassis, slot))
+            offset = self.get_cached_offset(chassis, slot)
             atten = (-1*value) + offset
             command = f"INP:ATT {-1*atten}"
         else:
             command = f"OUTP{slot}:POW {value}"
-        self.refresh_connection()
-        self.instrument.write(command)
+        try:
+            self.instrument.write(command)
+        except:
+            self.refresh_connection()
+            self.instrument.write(command)
+
+    def benchmark_pset(self, chassis, slot, repeats=20):
+        """
+        Average seconds per get_pset() call with the offset cache and with the offset re-read on
+        every call (the behaviour without the cache).  Returns (cached, uncached).
+        Only EXFO modules read the offset in get_pset(), so only they show a difference.
+        """
+        max_age = self.offset_max_age
+        timings = []
+        try:
+            for age in (max_age, -1):
+                self.offset_max_age = age
+                self.get_pset(chassis, slot)
+                start = time.perf_counter()
+                for i in range(repeats):
+                    self.get_pset(chassis, slot)
+                timings.append((time.perf_counter() - start) / repeats)
+        finally:
+            self.offset_max_age = max_age
+        return tuple(timings)
 
     """
     Below will only work for Agilent/HP/Keysignt:
@@ -249,11 +544,58 @@ class Attenuator(Instrument):
         response = self.instrument.query(command)
         return response
 
+    @IOScheduler.priority(IO_CONTROL)
+    def play_profile(self, chassis, slot, times, attenuations, latency=0.005, max_late=None):
+        """
+        Plays back an attenuation profile: attenuations[i] (dB) is applied times[i] seconds after the start.
+        All command strings are built before the start, and every write is timed against the
+        monotonic clock rather than chained sleeps, so timing errors do not accumulate.
+        latency (s) is the starting estimate of the write time; it is updated from the measured
+        writes and each write is issued that much early.  Points more than max_late seconds behind
+        schedule are skipped.
+        Returns an AttenuationProfileResult; actual holds the time each write completed (nan if skipped).
+        """
+        times = np.asarray(times, dtype=float)
+        attenuations = np.asarray(attenuations, dtype=float)
+        if times.shape != attenuations.shape:
+            raise ValueError("times and attenuations must be the same length.")
+        if np.any(np.diff(times) < 0):
+            raise ValueError("Profile times must be in increasing order.")
+        commands = [self.attenuation_command(chassis, slot, round(float(value), 3)) for value in attenuations]
+        actual = np.full(len(times), np.nan)
+        write = self.instrument.write
+        start = time.monotonic()
+        for i, command in enumerate(commands):
+            # Sleep coarsely, then spin for the last few milliseconds
+            issue_at = start + times[i] - latency
+            remaining = issue_at - time.monotonic()
+            if remaining > 0.002:
+                time.sleep(remaining - 0.002)
+            while time.monotonic() < issue_at:
+                pass
+            sent = time.monotonic()
+            if max_late is not None and sent - start - times[i] > max_late:
+                continue
+            write(command)
+            done = time.monotonic()
+            actual[i] = done - start
+            latency = 0.8 * latency + 0.2 * (done - sent)
+        error = actual - times
+        played = error[~np.isnan(error)]
+        if len(played):
+            max_error = np.abs(played).max()
+            rms_error = np.sqrt(np.mean(played ** 2))
+        else:
+            max_error = rms_error = np.nan
+        return AttenuationProfileResult(times, actual, error, max_error, rms_error, len(times) - len(played))
+
 
 class PowerMeter(Instrument):
 
     def __init__(self, address=None, nickname="Power Meter"):
         super().__init__(address, nickname)
+        self.power_layout = None
+        self.read_all = True
 
     def set_unit(self, input_num, channel=1, unit=0):
         self.refresh_connection()
@@ -305,6 +647,54 @@ class PowerMeter(Instrument):
             response = self.instrument.query(command)
             return response
 
+    def get_power_layout(self):
+        """
+        (slot, channel) of every power channel in the mainframe, in :READ:POW:ALL? order.
+        Read once and cached, the layout only changes when modules are swapped.
+        """
+        if self.power_layout is None:
+            pairs = self.instrument.query_binary_values(
+                ":READ:POW:ALL:CONF?", datatype='H', is_big_endian=False, container=np.array)
+            self.power_layout = [(int(slot), int(channel)) for slot, channel in zip(pairs[0::2], pairs[1::2])]
+        return self.power_layout
+
+    def get_all_powers(self, slots=None, channels=(1, 2)):
+        """
+        Power of every sensor head in the chassis in one round-trip, as {(slot, channel): power}.
+        Uses :READ:POW:ALL? (binary block); on firmware without it, falls back to one batched
+        :FETC query over slots (e.g. the "Power Meter" slots from InstrumentGUI.identify_instruments)
+        and channels.
+        """
+        if self.read_all:
+            try:
+                layout = self.get_power_layout()
+                values = self.instrument.query_binary_values(
+                    ":READ:POW:ALL?", datatype='f', is_big_endian=False, container=np.array)
+                return dict(zip(layout, (float(value) for value in values)))
+            except pyvisa.errors.VisaIOError:
+                self.read_all = False
+                self.clear()
+        if slots is None:
+            raise ValueError("slots are needed on firmware without :READ:POW:ALL?")
+        layout = [(slot, channel) for slot in slots for channel in channels]
+        command = ";".join(f":FETC{slot}:CHAN{channel}:POW?" for slot, channel in layout)
+        try:
+            response = self.instrument.query(command).split(";")
+            # A missing channel drops its reply, so the readings can only be matched up when all are there
+            if len(response) == len(layout):
+                return dict(zip(layout, (float(value) for value in response)))
+        except pyvisa.errors.VisaIOError:
+            # A missing channel can also fail the whole batch
+            self.clear()
+        # Read the heads one by one instead
+        powers = {}
+        for slot, channel in layout:
+            try:
+                powers[(slot, channel)] = float(self.get_power(slot, channel))
+            except:
+                powers[(slot, channel)] = None
+        return powers
+
     def enable(self, slot, channel=1):
         command = f"OUTP{slot}:CHAN{channel}:STAT 1"
         self.instrument.write(command)
@@ -321,6 +711,84 @@ class PowerMeter(Instrument):
         response = self.instrument.query(command)
         return response
 
+    """
+    Logging (LOGG) and stability (STAB) functions: the sensor stores its readings internally (one
+    per trigger, or free running) and returns them as one binary block.  With averaging times down
+    to 100 us this captures power at kHz rates without polling.
+    """
+
+    def configure_logging(self, slot, points, averaging_time, trigger="SME"):
+        """
+        averaging_time is in s.  trigger is the input trigger mode: SME (one reading per
+        trigger, e.g. from a laser sweep) or IGN (free running).
+        """
+        self.instrument.write(f":SENS{slot}:FUNC:PAR:LOGG {int(points)},{averaging_time}s")
+        self.instrument.write(f":TRIG{slot}:INP {trigger}")
+
+    def set_trigger_loopback(self):
+        """
+        Routes the mainframe's trigger output (e.g. a laser sweep step) back to the module trigger inputs.
+        """
+        self.instrument.write(":TRIG:CONF LOOP")
+
+    def configure_stability(self, slot, total_time, period, averaging_time):
+        """
+        One reading averaged over averaging_time every period, for total_time (all in s).
+        """
+        self.instrument.write(f":SENS{slot}:FUNC:PAR:STAB {total_time}s,{period}s,{averaging_time}s")
+        self.instrument.write(f":TRIG{slot}:INP IGN")
+
+    def start_logging(self, slot, function="LOGG"):
+        self.instrument.write(f":SENS{slot}:FUNC:STAT {function},STAR")
+
+    def stop_logging(self, slot, function="LOGG"):
+        self.instrument.write(f":SENS{slot}:FUNC:STAT {function},STOP")
+
+    @IOScheduler.priority(IO_MONITORING)
+    def wait_for_logging(self, slot, timeout=60, poll_interval=0.1):
+        deadline = time.monotonic() + timeout
+        while "COMPLETE" not in self.instrument.query(f":SENS{slot}:FUNC:STAT?").upper():
+            if time.monotonic() > deadline:
+                raise Instrument.TimeoutError(f"Logging on slot {slot} did not complete within {timeout} s")
+            time.sleep(poll_interval)
+
+    def get_logging_result(self, slot, channel=1):
+        """
+        Logged readings in W as a numpy array, read in one binary block transfer.
+        """
+        command = f":SENS{slot}:CHAN{channel}:FUNC:RES?"
+        result = self.instrument.query_binary_values(
+            command, datatype='f', is_big_endian=False, container=np.array)
+        return result
+
+    def log_power(self, slot, points, averaging_time, channel=1, dbm=False):
+        """
+        Free-running capture of points readings, each averaged over averaging_time (s).
+        Returns a numpy array in W (or dBm).
+        """
+        self.configure_logging(slot, points, averaging_time, trigger="IGN")
+        self.start_logging(slot)
+        self.wait_for_logging(slot, timeout=points * averaging_time * 2 + 10)
+        result = self.get_logging_result(slot, channel)
+        if dbm:
+            with np.errstate(divide="ignore"):
+                result = 10 * np.log10(result * 1000)
+        return result
+
+    def log_stability(self, slot, total_time, period, averaging_time, channel=1, dbm=False):
+        """
+        Long-term stability capture, see configure_stability().
+        Returns (time s, power) numpy arrays, power in W (or dBm).
+        """
+        self.configure_stability(slot, total_time, period, averaging_time)
+        self.start_logging(slot, "STAB")
+        self.wait_for_logging(slot, timeout=total_time * 1.5 + 10, poll_interval=min(period, 1))
+        result = self.get_logging_result(slot, channel)
+        if dbm:
+            with np.errstate(divide="ignore"):
+                result = 10 * np.log10(result * 1000)
+        return np.arange(len(result)) * period, result
+
 
 class Tunable_Laser(Instrument):
 
@@ -336,6 +804,10 @@ class Tunable_Laser(Instrument):
         response = self.instrument.query(command)
         return response
 
+    def set_power(self, slot, power, channel=1):
+        command = f":SOUR{slot}:CHAN{channel}:POW {power}dBm"
+        self.instrument.write(command)
+
     def get_power(self, slot, channel=1):
         command = f":SOUR{slot}:CHAN{channel}:POW?"
         response = self.instrument.query(command)
@@ -367,6 +839,51 @@ class Tunable_Laser(Instrument):
         response = self.instrument.query(command)
         return response
 
+    def configure_sweep(self, slot, start, stop, step, speed, cycles=1):
+        """
+        Continuous sweep from start to stop (nm) at speed (nm/s), with a trigger output pulse
+        every step (nm) and lambda logging, so every trigger has a logged wavelength.
+        """
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:MODE CONT")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:STAR {start}nm")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:STOP {stop}nm")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:STEP {step}nm")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:SPE {speed}nm/s")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:CYCL {cycles}")
+        self.instrument.write(f":TRIG{slot}:OUTP STF")
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:LLOG 1")
+        response = self.instrument.query(f":SOUR{slot}:WAV:SWE:CHEC?")
+        if not response.startswith("0"):
+            raise ValueError(f"Sweep parameters rejected: {response.strip()}")
+
+    def get_sweep_points(self, slot):
+        """
+        Number of trigger pulses (logged points) the configured sweep will produce.
+        """
+        command = f":SOUR{slot}:WAV:SWE:EXP?"
+        response = self.instrument.query(command)
+        return int(float(response))
+
+    def start_sweep(self, slot):
+        self.instrument.write(f":SOUR{slot}:WAV:SWE:STAT 1")
+
+    @IOScheduler.priority(IO_MONITORING)
+    def wait_for_sweep(self, slot, timeout=120, poll_interval=0.1):
+        deadline = time.monotonic() + timeout
+        while int(float(self.instrument.query(f":SOUR{slot}:WAV:SWE:STAT?"))) != 0:
+            if time.monotonic() > deadline:
+                raise Instrument.TimeoutError(f"Sweep on slot {slot} did not finish within {timeout} s")
+            time.sleep(poll_interval)
+
+    def get_sweep_wavelengths(self, slot):
+        """
+        Logged wavelength (nm) of every trigger of the last sweep, read in one binary block transfer.
+        """
+        command = f":SOUR{slot}:READ:DATA? LLOG"
+        wavelength = self.instrument.query_binary_values(
+            command, datatype='d', is_big_endian=False, container=np.array)
+        return wavelength * 1e9
+
 
 class Reference_Transmitter(Instrument):
 
@@ -454,6 +971,7 @@ class OSNR(Instrument):
     def get_osnr(self):                 # DO NOT USE
         """
         Unstable command, need to report ot OZ Optics / YY Labs
+        Use OSNR_Control.OSNRController to reach a target OSNR measured on the OSA instead.
         """
         command = "R?DB"
         response = self.instrument.query(command).split()[4][0:5]
@@ -503,10 +1021,55 @@ class OSNR(Instrument):
 
 
 class OSA(Instrument):
+    """
+    Sweep data, analysis results and parameter reads are memoised against sweep_generation.
+    The generation is bumped by every sweep command and setting change, so repeated reads of
+    the same sweep cost no GPIB traffic.  Nothing is memoised while in repeat sweep or before a
+    single/auto sweep has finished (SWEEP? polled).  Pass refresh=True, or call bump_generation()
+    after front-panel changes, to re-read the instrument.
+    """
 
     def __init__(self, address=None, nickname="OSA"):
+        self.sweep_generation = 0
+        self.sweep_cache = {}
+        self.repeating = False
+        self.sweeping = False
         super().__init__(address, nickname)
 
+    # Invalidate memoised reads after a sweep or setting change
+    def bump_generation(self):
+        self.sweep_generation += 1
+        self.sweep_cache = {}
+
+    # Return the memoised result of func for the current sweep generation, refresh re-reads it
+    # Nothing is memoised until a single/auto sweep has finished
+    def cached_read(self, key, func, refresh=False):
+        if self.repeating or (self.sweeping and not self.sweep_finished()):
+            return func()
+        if refresh or key not in self.sweep_cache:
+            self.sweep_cache[key] = func()
+        return self.sweep_cache[key]
+
+    # SWEEP? returns 0 once the sweep has stopped
+    def sweep_finished(self):
+        if self.instrument.query("SWEEP?").strip() == "0":
+            self.sweeping = False
+        return not self.sweeping
+
+    @IOScheduler.priority(IO_MONITORING)
+    def wait_for_sweep(self, timeout=60, poll_interval=0.5):
+        deadline = time.monotonic() + timeout
+        while not self.sweep_finished():
+            if time.monotonic() > deadline:
+                raise Instrument.TimeoutError(f"Sweep did not finish within {timeout} s")
+            time.sleep(poll_interval)
+
+    def reset(self):
+        super().reset()
+        self.repeating = False
+        self.sweeping = False
+        self.bump_generation()
+
     # Check if it's in AQ6317 Compatible Mode
     def command_mode(self):
         command2 = ":SYSTem:COMMunicate:CFORmat AQ6317"
@@ -527,6 +1090,7 @@ class OSA(Instrument):
         # file name format: Sxxxx.ST6
         command2 = f"MMEMORY:LOAD:SETTING \"{filename}\",INTERNAL"
         self.instrument.write(command2)
+        self.bump_generation()
 
     # Save setup file internal
     def save_set(self, filename):
@@ -551,71 +1115,89 @@ class OSA(Instrument):
     def auto_sweep(self):
         command = "AUTO"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = True
+        self.bump_generation()
 
     def repeat_sweep(self):
         command = "RPT"
         self.instrument.write(command)
+        self.repeating = True
+        self.sweeping = False
+        self.bump_generation()
 
     def single_sweep(self):
         command = "SGL"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = True
+        self.bump_generation()
 
     def stop_sweep(self):
         command = "STP"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = False
+        self.bump_generation()
 
     def set_center(self, wl):
         command = f"CTRWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_start(self, wl):
         command = f"STAWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_stop(self, wl):
         command = f"STPWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_span(self, wl):
         command = f"SPAN{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_resolution(self, rsln):
         command = f"RESLN{rsln}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_noise_bw(self, nbw):
         command = f"WDMNOIBW{nbw}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def get_center(self):
         command = "CTRWL?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def get_start(self):
         command = "STAWL?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def get_stop(self):
         command = "STPWL?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def get_span(self):
         command = "SPAN?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def get_resolution(self):
         command = "RESLN?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def get_noise_bw(self):
         command = "WDMNOIBW?"
-        response = self.instrument.query(command)
+        response = self.cached_read(command, lambda: self.instrument.query(command))
         return response
 
     def set_smsr_mode(self):
@@ -626,7 +1208,11 @@ class OSA(Instrument):
         command = f"WDMAN"
         self.instrument.write(command)
 
-    def get_osnr_values(self):
+    def get_osnr_values(self, refresh=False):
+        response = self.cached_read("WDM ANA?", self.query_osnr_values, refresh)
+        return list(response)
+
+    def query_osnr_values(self):
         self.set_wdm_mode()
         command = "ANA?"
         response = self.instrument.query(command).replace(
@@ -637,7 +1223,18 @@ class OSA(Instrument):
         response = self.get_osnr_values()[3]
         return response
 
-    def get_smsr_values(self):
+    def get_dwdm_table(self, grid, threshold=-50):
+        """
+        Per-channel power, OSNR and wavelength offset for every channel of the grid (THz),
+        analysed on the host from one captured trace.  See OSA_Analysis.dwdm_grid_analysis().
+        Use OSA_Analysis.itu_grid() or itu_channel_frequency() to build the grid.
+        """
+        wavelength, amplitude = self.get_trace()
+        resolution = float(self.get_resolution())
+        noise_bw = float(self.get_noise_bw())
+        return dwdm_grid_analysis(wavelength, amplitude, grid, resolution, noise_bw, threshold)
+
+    def get_smsr_values(self, refresh=False):
         """
         Method returns a list, mapping shown below, can be easily modified to output dict.
         peak_wavelength = response[0]
@@ -647,6 +1244,10 @@ class OSA(Instrument):
         wavelength_difference = response[4]
         level_difference = response[5]
         """
+        response = self.cached_read("SMSR ANA?", self.query_smsr_values, refresh)
+        return list(response)
+
+    def query_smsr_values(self):
         self.set_smsr_mode()
         command = "ANA?"
         response = self.instrument.query(command).replace(" ", "").split(",")
@@ -659,13 +1260,24 @@ class OSA(Instrument):
                          "level_difference": response[5]}
         return response
 
-    def fetch_screen(self):
+    def get_trace(self, refresh=False):
+        """
+        Returns (wavelength, amplitude) lists for the current sweep.
+        """
+        wavelength, amplitude = self.cached_read("TRACE", self.query_trace, refresh)
+        return list(wavelength), list(amplitude)
+
+    def query_trace(self):
         amplitude = self.instrument.query(
             "LDATA").replace(" ", "").split(",")[1:]
         wavelength = self.instrument.query(
             "WDATA").replace(" ", "").split(",")[1:]
         amplitude = [float(val) for val in amplitude]
         wavelength = [float(val) for val in wavelength]
+        return wavelength, amplitude
+
+    def fetch_screen(self):
+        wavelength, amplitude = self.get_trace()
         plt.plot(wavelength, amplitude)
         plt.xlabel('Wavelength (nm)')
         plt.ylabel('Amplitude (dBm)')
@@ -692,12 +1304,7 @@ class OSA(Instrument):
         """
         Assumes OSA is already in WDM Mode
         """
-        amplitude = self.instrument.query(
-            "LDATA").replace(" ", "").split(",")[1:]
-        wavelength = self.instrument.query(
-            "WDATA").replace(" ", "").split(",")[1:]
-        amplitude = [float(val) for val in amplitude]
-        wavelength = [float(val) for val in wavelength]
+        wavelength, amplitude = self.get_trace()
         fig, (ax1, ax2) = plt.subplots(
             2, 1, gridspec_kw={'height_ratios': [3, 1]})
         ax1.plot(wavelength, amplitude)
@@ -733,12 +1340,7 @@ class OSA(Instrument):
         """
         Assumes OSA is already in SMSR Mode
         """
-        amplitude = self.instrument.query(
-            "LDATA").replace(" ", "").split(",")[1:]
-        wavelength = self.instrument.query(
-            "WDATA").replace(" ", "").split(",")[1:]
-        amplitude = [float(val) for val in amplitude]
-        wavelength = [float(val) for val in wavelength]
+        wavelength, amplitude = self.get_trace()
         fig, (ax1, ax2) = plt.subplots(
             2, 1, gridspec_kw={'height_ratios': [3, 1]})
         ax1.plot(wavelength, amplitude)
@@ -778,29 +1380,98 @@ class OSA(Instrument):
         plt.close()
 
 
+# (field, query) pairs read by Oscilloscope.get_eye_snapshot(), in response order
+EYE_SNAPSHOT_QUERIES = [("tj", ":MEASure:JITTer:TJ?"),
+                        ("ddj", ":MEASure:JITTer:DDJ?"),
+                        ("rise_time", ":MEASure:OSCilloscope:RISetime:Mean?"),
+                        ("fall_time", ":MEASure:OSCilloscope:FALLtime:Mean?"),
+                        ("extinction_ratio", ":MEASure:CGRade:ERATio?"),
+                        ("crossing_point", ":MEASure:CGRade:CROSsing?"),
+                        ("tdec", ":MEASure:CGRade:TDEc?"),
+                        ("tdecq", ":MEASure:EYE:TDEQ?"),
+                        ("oer", ":MEASure:EYE:OER?"),
+                        ("margin", ":MEASure:MTESt:MARGin?")]
+EyeSnapshot = namedtuple("EyeSnapshot", ["timestamp"] + [field for field, query in EYE_SNAPSHOT_QUERIES] + ["questionable"])
+
+# Value returned by the scope when a measurement cannot be made
+SCOPE_INVALID_VALUE = 9.9e37
+
+
 class Oscilloscope(Instrument):
     def __init__(self, address=None, nickname="Oscilloscope"):
         super().__init__(address, nickname)
+        self.direct_screen = True
+        self.batch_queries = True
+        self.invalidate_state()
 
-    def fetch_screen(self):
+    def invalidate_state(self):
+        """
+        Forget the tracked mode/lock/filter/CDR state, e.g. after changes from the front panel.
+        Mode and configuration writes are skipped (with their settle delays) when the tracked
+        state already matches.
+        """
+        self.mode = None
+        self.pattern_lock = None
+        self.filter_state = {}
+        self.filter_rate = {}
+        self.cdr_rate = {}
+
+    def reset(self):
+        super().reset()
+        self.invalidate_state()
+
+    def fetch_screen(self, inverted=True):
+        """
+        Pulls the display image as a PNG binary block and writes the raw bytes to disk.
+        Firmware without :DISPlay:DATA? falls back to saving on the scope's disk (see fetch_screen_from_disk).
+        inverted selects inverted colours (white background).
+        """
         filename = rf'oscilloscop_capture_{time.time()}.png'
+        self.instrument.write(":DISPlay:TOVerlap 0")
+        image_data = None
+        if self.direct_screen:
+            inversion = "INVert" if inverted else "NORMal"
+            try:
+                image_data = self.instrument.query_binary_values(
+                    f":DISPlay:DATA? PNG,SCReen,ON,{inversion}", datatype='B', container=bytes)
+            except pyvisa.errors.VisaIOError:
+                self.direct_screen = False
+                self.clear()
+        if image_data is None:
+            image_data = self.fetch_screen_from_disk(filename, inverted)
+        save_dir = 'Oscilloscope_Plots'
+        os.makedirs(save_dir, exist_ok=True)
+        save_path = os.path.join(save_dir, filename)
+        with open(save_path, "wb") as file:
+            file.write(image_data)
+        return save_path
+
+    def fetch_screen_from_disk(self, filename, inverted=True):
         filepath = rf'D:\User Files\python_instruments_images\{filename}'
-        self.instrument.write(":DISK:SIMage:INVert 1")
+        self.instrument.write(f":DISK:SIMage:INVert {int(inverted)}")
         self.instrument.write(fr':DISK:SIMage:FNAMe "{filepath}"')
-        self.instrument.write(":DISPlay:TOVerlap 0")
         self.instrument.write(":DISK:SIMage:SAVE")
-        time.sleep(5)
+        self.wait_for_completion()
         image_data = self.instrument.query_binary_values(
             f':DISK:BFILe? "{filepath}"', datatype='B', container=bytes)
-        image = Image.open(io.BytesIO(image_data))
-        save_dir = 'Oscilloscope_Plots'
-        os.makedirs(save_dir, exist_ok=True)
-        save_path = os.path.join(save_dir, filename)
-        image.save(save_path)
+        return image_data
+
+    def wait_for_completion(self, timeout=20000):
+        """
+        Blocks on *OPC? until the previous command has finished, instead of a fixed sleep.
+        timeout is in ms.
+        """
+        previous_timeout = self.instrument.timeout
+        self.instrument.timeout = max(previous_timeout, timeout)
+        try:
+            self.instrument.query("*OPC?")
+        finally:
+            self.instrument.timeout = previous_timeout
 
     def autoscale(self):
         command = ":SYSTem:AUToscale"
         self.instrument.write(command)
+        self.pattern_lock = None
         time.sleep(5)
 
     def run(self):
@@ -811,42 +1482,54 @@ class Oscilloscope(Instrument):
         command = ":ACQuire:STOP"
         self.instrument.write(command)
 
-    def oscilloscope_mode(self):
-        command = ":SYSTem:MODE OSCilloscope"
+    def set_mode(self, mode):
+        if self.mode == mode:
+            return
+        command = f":SYSTem:MODE {mode}"
         self.instrument.write(command)
+        self.mode = mode
         time.sleep(3)
 
+    def oscilloscope_mode(self):
+        self.set_mode("OSCilloscope")
+
     def jitter_mode(self):
-        command = ":SYSTem:MODE JITTer"
-        self.instrument.write(command)
-        time.sleep(3)
+        self.set_mode("JITTer")
 
     def tdr_mode(self):
-        command = ":SYSTem:MODE TDR"
-        self.instrument.write(command)
-        time.sleep(3)
+        self.set_mode("TDR")
 
     def eye_mode(self):
-        command = ":SYSTem:MODE EYE"
-        self.instrument.write(command)
-        time.sleep(3)
+        self.set_mode("EYE")
 
     def enable_pattern_lock(self):
+        if self.pattern_lock is True:
+            return
         command = ":TRIGger:PLOCk ON"
         self.instrument.write(command)
+        self.pattern_lock = True
         time.sleep(5)
 
     def disable_pattern_lock(self):
+        if self.pattern_lock is False:
+            return
         command = ":TRIGger:PLOCk OFF"
         self.instrument.write(command)
+        self.pattern_lock = False
 
     def enable_filter(self, channel):
+        if self.filter_state.get(channel) is True:
+            return
         command = f":CHAN{channel}A:FILTer ON"
         self.instrument.write(command)
+        self.filter_state[channel] = True
 
     def disable_filter(self, channel):
+        if self.filter_state.get(channel) is False:
+            return
         command = f":CHAN{channel}A:FILTer OFF"
         self.instrument.write(command)
+        self.filter_state[channel] = False
 
     def set_filter_speed(self, channel, speed):
         """
@@ -857,8 +1540,11 @@ class Oscilloscope(Instrument):
         2.6562500E+10
         5.3125000E+10
         """
+        if self.filter_rate.get(channel) == float(speed):
+            return
         command = f":CHAN{channel}A:FSELect:RATe {speed}"
         self.instrument.write(command)
+        self.filter_rate[channel] = float(speed)
 
     def enable_input(self, channel):
         command = f":CHAN{channel}A:DISlay ON"
@@ -881,9 +1567,12 @@ class Oscilloscope(Instrument):
         2.6562500E+10
         5.3125000E+10
         """
-        command = f":CRECovery{channel}CRATe {speed}"
-        self.instrument.write(command)
-        self.CDR_relock()
+        # Only the rate write is skipped when unchanged, the relock always runs
+        if self.cdr_rate.get(channel) != float(speed):
+            command = f":CRECovery{channel}:CRATe {speed}"
+            self.instrument.write(command)
+            self.cdr_rate[channel] = float(speed)
+        self.CDR_relock(channel)
 
     def measure_jitter(self):
         self.instrument.write(":MEASure:JITTer:DEFine:UNITs UINTerval")
@@ -907,14 +1596,56 @@ class Oscilloscope(Instrument):
         count = self.instrument.query(command)
         return count
 
-    def wait_for_acquisition(self):
-        count1 = -1
-        count2 = -2
-        while count1 != count2:
-            count1 = self.check_acquisition()
-            time.sleep(5)
-            count2 = self.check_acquisition()
-            time.sleep(5)
+    def get_acquisition_count(self):
+        return int(float(self.check_acquisition()))
+
+    def set_acquisition_target(self, count, count_type="WAVeforms"):
+        """
+        count_type is WAVeforms or PATTerns.  The scope stops acquiring once count is reached.
+        """
+        self.instrument.write(f":LTESt:ACQuire:CTYPe:{count_type} {count}")
+        self.instrument.write(":LTESt:ACQuire:STATe ON")
+
+    @IOScheduler.priority(IO_MONITORING)
+    def wait_for_acquisition(self, target=None, timeout=120, min_interval=0.05, max_interval=5):
+        """
+        Polls the acquisition count until it reaches target, or (target=None) until it stops moving.
+        The poll interval follows the observed acquisition rate: it aims at the time the target
+        should be reached, bounded by min_interval and max_interval (s).
+        Raises Instrument.TimeoutError after timeout seconds.  Returns the final count.
+        """
+        deadline = time.monotonic() + timeout
+        last_count = self.get_acquisition_count()
+        last_time = time.monotonic()
+        rate = None
+        interval = min_interval
+        while True:
+            if target is not None and last_count >= target:
+                return last_count
+            if target is not None and rate:
+                interval = (target - last_count) / rate
+            elif rate:
+                # Stable means no new acquisition for a few expected increments
+                interval = 3 / rate
+            interval = min(max(interval, min_interval), max_interval, max(deadline - time.monotonic(), 0))
+            time.sleep(interval)
+            count = self.get_acquisition_count()
+            now = time.monotonic()
+            if count > last_count:
+                rate = (count - last_count) / (now - last_time)
+                last_count = count
+                last_time = now
+            elif count < last_count:
+                # Acquisition was cleared and restarted
+                rate = None
+                last_count = count
+                last_time = now
+            elif target is None and (rate or now - last_time >= max_interval):
+                return count
+            else:
+                interval = interval * 2
+            if now >= deadline:
+                raise Instrument.TimeoutError(f"Acquisition count {count} did not reach {target} within {timeout} s")
 
     def get_margin(self):
         command = "MEAS:MTES:MARG?"
@@ -946,6 +1677,48 @@ class Oscilloscope(Instrument):
         response = self.instrument.query(command)
         return response
 
+    def get_eye_snapshot(self):
+        """
+        Reads jitter, rise/fall, ER, crossing, TDEC, TDECQ, OER and mask margin in one batched query
+        (falls back to one query per measurement if the firmware rejects the batch; a timeout only
+        falls back for that call).
+        Returns an EyeSnapshot of floats in the scope's units.  Measurements the scope could not make
+        are NaN and their names are listed in EyeSnapshot.questionable.
+        """
+        self.instrument.write(":MEASure:JITTer:DEFine:UNITs UINTerval")
+        timestamp = time.time()
+        responses = None
+        if self.batch_queries:
+            try:
+                responses = self.instrument.query(";".join(query for field, query in EYE_SNAPSHOT_QUERIES)).split(";")
+            except pyvisa.errors.VisaIOError:
+                self.clear()
+                responses = None
+            if responses is not None and len(responses) != len(EYE_SNAPSHOT_QUERIES):
+                self.batch_queries = False
+                self.clear()
+                responses = None
+        if responses is None:
+            responses = []
+            for field, query in EYE_SNAPSHOT_QUERIES:
+                try:
+                    responses.append(self.instrument.query(query))
+                except pyvisa.errors.VisaIOError:
+                    self.clear()
+                    responses.append("")
+        values = {}
+        questionable = []
+        for (field, query), response in zip(EYE_SNAPSHOT_QUERIES, responses):
+            try:
+                value = float(response)
+            except ValueError:
+                value = math.nan
+            if math.isnan(value) or abs(value) >= SCOPE_INVALID_VALUE:
+                value = math.nan
+                questionable.append(field)
+            values[field] = value
+        return EyeSnapshot(timestamp=timestamp, questionable=tuple(questionable), **values)
+
     def enable_function(self, channel):
         command = f":FUNC{channel}:DISPlay ON"
         self.instrument.write(command)
@@ -959,6 +1732,52 @@ class Oscilloscope(Instrument):
         response = self.instrument.query(command)
         return response
 
+    def get_unit_interval(self, CDR_channel=5):
+        """
+        Unit interval (s) of the recovered data rate, used to fold waveforms in Eye_Analysis.
+        The recovered clock period is get_CDR_ratio() unit intervals.
+        """
+        command = f":CRECovery{CDR_channel}:CRATe?"
+        rate = float(self.instrument.query(command))
+        return 1 / rate
+
+    def waveform_source(self, channel=None, function=None):
+        if function is not None:
+            return f"FUNC{function}"
+        return f"CHAN{channel}A"
+
+    def get_waveform_preamble(self, channel=None, function=None):
+        """
+        Returns the scaling fields of :WAVeform:PREamble? as a dict.
+        """
+        self.instrument.write(f":WAVeform:SOURce {self.waveform_source(channel, function)}")
+        response = self.instrument.query(":WAVeform:PREamble?").split(",")
+        preamble = {"points": int(float(response[2])),
+                    "count": int(float(response[3])),
+                    "x_increment": float(response[4]),
+                    "x_origin": float(response[5]),
+                    "x_reference": float(response[6]),
+                    "y_increment": float(response[7]),
+                    "y_origin": float(response[8]),
+                    "y_reference": float(response[9])}
+        return preamble
+
+    def get_waveform(self, channel=1, function=None, chunk_size=1024*1024):
+        """
+        Transfers a channel (or function, if given) waveform in binary WORD format into numpy.
+        Returns (time, volts) arrays in seconds and volts, scaled from the preamble.
+        chunk_size is the VISA read size in bytes, larger values speed up long records.
+        """
+        self.instrument.write(":WAVeform:FORMat WORD")
+        self.instrument.write(":WAVeform:BYTeorder LSBFirst")
+        preamble = self.get_waveform_preamble(channel, function)
+        data = self.instrument.query_binary_values(
+            ":WAVeform:DATA?", datatype='h', is_big_endian=False,
+            container=np.array, chunk_size=chunk_size)
+        volts = (data - preamble["y_reference"]) * preamble["y_increment"] + preamble["y_origin"]
+        time_axis = (np.arange(len(data)) - preamble["x_reference"]) * preamble["x_increment"] + preamble["x_origin"]
+        return time_axis, volts
+
 
 class Polatis_Switch(Instrument):
 
@@ -982,10 +1801,60 @@ class Polatis_Switch(Instrument):
         response = self.instrument.query(command)
         return response
 
+    def port_list(self, ports):
+        return "(@" + ",".join(str(port) for port in ports) + ")"
+
+    def get_connection_map(self):
+        """
+        Reads every crossconnect in one query.  Returns {input: output}.
+        """
+        command = ":oxc:swit:conn:stat?"
+        response = self.instrument.query(command).replace(" ", "").replace("\r", "").replace("\n", "")
+        inputs, outputs = response.split("),(")
+        inputs = [int(port) for port in inputs.strip("(@)").split(",") if port]
+        outputs = [int(port) for port in outputs.strip("(@)").split(",") if port]
+        return dict(zip(inputs, outputs))
+
+    @staticmethod
+    def connection_diff(current, desired, exclusive=False):
+        """
+        Minimal (remove, add) lists of (input, output) pairs that turn current into desired.
+        exclusive=True also removes connections that are not in desired; otherwise only
+        connections that conflict with desired (same input or output) are removed.
+        Static so Switch_Planner plans with the same diff that apply_connection_map() applies.
+        """
+        desired_outputs = set(desired.values())
+        remove = []
+        for input, output in current.items():
+            if desired.get(input) == output:
+                continue
+            if exclusive or input in desired or output in desired_outputs:
+                remove.append((input, output))
+        add = [(input, output) for input, output in desired.items() if current.get(input) != output]
+        return remove, add
+
+    def apply_connection_map(self, desired, exclusive=False, max_ports=64):
+        """
+        Reads the connection map once and applies only the difference to desired ({input: output})
+        using multi-port conn:sub / conn:add lists of up to max_ports pairs per command.
+        Returns the (remove, add) lists that were applied.
+        """
+        current = self.get_connection_map()
+        remove, add = self.connection_diff(current, desired, exclusive)
+        for pairs, action in ((remove, "sub"), (add, "add")):
+            for i in range(0, len(pairs), max_ports):
+                chunk = pairs[i:i + max_ports]
+                inputs = self.port_list(input for input, output in chunk)
+                outputs = self.port_list(output for input, output in chunk)
+                command = f":oxc:swit:conn:{action} {inputs},{outputs}"
+                self.instrument.write(command)
+        return remove, add
+
 
 class Frequency_Counter(Instrument):
     """
     Remember to use Oscilloscope.get_CDR_ratio() if creating algorithm for clock accuracy
+    (see Clock_Accuracy.py)
     """
 
     def __init__(self, address=None, nickname="Polatis Switch"):
@@ -1006,26 +1875,244 @@ class Frequency_Counter(Instrument):
             response = self.instrument.query(command)
         return response
 
+    def configure_buffered(self, count, input=3, gate_time=None):
+        """
+        Configures count frequency readings per trigger, returned as REAL,64 binary blocks.
+        gate_time is in s (None keeps the counter's setting).
+        """
+        if self.idn not in ("53220A", "53230A"):
+            print("Buffered acquisition not supported on this counter.")
+            raise Instrument.UnknownInstrumentError
+        self.instrument.write(f"CONF:FREQ DEF,DEF,(@{input})")
+        if gate_time is not None:
+            self.instrument.write(f"SENS:FREQ:GATE:TIME {gate_time}")
+        self.instrument.write("TRIG:COUN 1")
+        self.instrument.write(f"SAMP:COUN {count}")
+        self.instrument.write("FORM:DATA REAL,64")
+
+    def get_frequency_block(self, count, input=3, gate_time=None, callback=None, poll_interval=0.2, timeout=None):
+        """
+        Triggers once and streams count readings out of the counter's memory with R? while it
+        is still measuring.  Returns a numpy array of frequencies (Hz).
+        callback(readings, statistics) is called after every block, statistics is a
+        RunningStatistics over everything received so far.  If it returns True the measurement
+        is aborted and the readings received so far are returned.
+        The 53132A has no reading memory, so it falls back to one READ:FREQ? per reading.
+        timeout (s) defaults to count gate times (read back from the counter if gate_time is None)
+        plus 50% and 30 s margin.
+        """
+        statistics = RunningStatistics()
+        if self.idn == "53132A":
+            readings = np.empty(count)
+            for i in range(count):
+                readings[i] = float(self.get_frequency(input))
+                statistics.update(readings[i:i + 1])
+                if callback is not None and callback(readings[i:i + 1], statistics):
+                    return readings[:i + 1]
+            return readings
+        self.configure_buffered(count, input, gate_time)
+        if timeout is None:
+            if gate_time is None:
+                gate_time = float(self.instrument.query("SENS:FREQ:GATE:TIME?"))
+            timeout = count * gate_time * 1.5 + 30
+        self.instrument.write("INIT")
+        blocks = []
+        received = 0
+        deadline = time.monotonic() + timeout
+        try:
+            while received < count:
+                if time.monotonic() > deadline:
+                    raise Instrument.TimeoutError(f"Received {received} of {count} readings within {timeout} s")
+                block = self.instrument.query_binary_values(
+                    "R?", datatype='d', is_big_endian=True, container=np.array)
+                if len(block) == 0:
+                    time.sleep(poll_interval)
+                    continue
+                blocks.append(block)
+                received += len(block)
+                statistics.update(block)
+                if callback is not None and callback(block, statistics):
+                    self.instrument.write("ABOR")
+                    break
+        finally:
+            self.instrument.write("FORM:DATA ASCII")
+        return np.concatenate(blocks)[:count]
+
+
+class RunningStatistics:
+    """
+    Streaming count/mean/standard deviation/min/max (Welford), updated one block at a time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        count = len(values)
+        mean = values.mean()
+        delta = mean - self.mean
+        total = self.count + count
+        self.m2 += ((values - mean) ** 2).sum() + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    def std(self):
+        if self.count < 2:
+            return math.nan
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+PRBS_POLYNOMIALS = ["2^7-1", "2^9-1", "2^10-1", "2^11-1", "2^13-1", "2^15-1", "2^23-1", "2^31-1"]
+SEQUENCE_XML_HEADER = ('<?xml version="1.0" encoding="utf-16"?><sequenceDefinition '
+                       'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+                       'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                       'xmlns="http://www.agilent.com/schemas/M8000/DataSequence">  <description />  <sequence>')
+SEQUENCE_XML_FOOTER = '  </sequence></sequenceDefinition>'
+
+
+def ieee_block(payload):
+    """
+    IEEE 488.2 definite length block: #<number of length digits><length><payload>
+    """
+    length = str(len(payload.encode()))
+    return f"#{len(length)}{length}{payload}"
+
+
+@lru_cache(maxsize=None)
+def prbs_sequence(polynomial="2^31-1", length=256, analyzer=False):
+    """
+    M8000 sequence definition for a looping PRBS.  The analyzer version syncs on the pattern.
+    Encoded definitions are cached, so repeated pattern changes cost no rebuilding.
+    """
+    if polynomial not in PRBS_POLYNOMIALS:
+        raise ValueError(f"Unsupported PRBS polynomial {polynomial}, use one of {PRBS_POLYNOMIALS}")
+    if analyzer:
+        body = (f'    <syncAndLoopBlock length="{length}">      <prbs polynomial="{polynomial}" />'
+                f'    </syncAndLoopBlock>')
+    else:
+        body = (f'    <loop>      <block length="{length}">        <prbs polynomial="{polynomial}" />'
+                f'      </block>    </loop>')
+    return ieee_block(SEQUENCE_XML_HEADER + body + SEQUENCE_XML_FOOTER)
+
+
+# Error accumulation commands, {location} is an analyzer input such as M1.DataIn1
+BER_RESET_COMMAND = ":SENSe:EACounter:RESet '{location}'"
+BER_BITS_QUERY = ":FETCh:EACounter:BITS? '{location}'"
+BER_ERRORS_QUERY = ":FETCh:EACounter:ERRors? '{location}'"
+
+BerResult = namedtuple("BerResult", ["bits", "errors", "ber", "ber_upper", "verdict", "duration"])
+
+
+def poisson_cdf(errors, expected):
+    """
+    P(X <= errors) for a Poisson count with mean expected.
+    """
+    if expected <= 0:
+        return 1.0
+    if errors < 0:
+        return 0.0
+    if errors > 100000:
+        # Normal approximation, the exact sum gets too long
+        return 0.5 * math.erfc((expected - errors - 0.5) / math.sqrt(2 * expected))
+    k = np.arange(int(errors) + 1)
+    log_factorial = np.concatenate(([0], np.cumsum(np.log(k[1:]))))
+    log_terms = k * math.log(expected) - expected - log_factorial
+    largest = log_terms.max()
+    return min(math.exp(largest) * np.exp(log_terms - largest).sum(), 1.0)
+
+
+def ber_upper_bound(bits, errors, confidence=0.95):
+    """
+    BER that is not exceeded with the given confidence after errors in bits compared bits.
+    """
+    if bits <= 0:
+        return 1.0
+    low = 0.0
+    high = max(errors + 1, 1) * 10.0
+    while poisson_cdf(errors, high) > 1 - confidence:
+        high *= 2
+    for i in range(60):
+        middle = (low + high) / 2
+        if poisson_cdf(errors, middle) > 1 - confidence:
+            low = middle
+        else:
+            high = middle
+    return high / bits
+
+
+def ber_verdict(bits, errors, target_ber, confidence=0.95):
+    """
+    "pass" once BER < target_ber is proven, "fail" once BER > target_ber is proven,
+    otherwise "undecided".
+    """
+    expected = bits * target_ber
+    if poisson_cdf(errors, expected) <= 1 - confidence:
+        return "pass"
+    if errors > 0 and 1 - poisson_cdf(errors - 1, expected) <= 1 - confidence:
+        return "fail"
+    return "undecided"
+
 
 class BERT(Instrument):
+    """
+    Sequence definitions and bindings sent through set_sequence()/bind_sequence() are tracked,
+    and re-sending a sequence or binding that is already active is skipped.
+    """
 
     def __init__(self, address="TCPIP0::172.20.240.110::5025::SOCKET", nickname="BERT"):
         super().__init__(address, nickname)
+        self.invalidate_sequences()
+
+    def invalidate_sequences(self):
+        self.sequences = {}
+        self.bindings = {}
+
+    def reset(self):
+        super().reset()
+        self.invalidate_sequences()
 
     def recall_instrument_state(self, filename):
         command = f"MMEMory:WORKspace:SETTings:USER:RECall '{filename}'"
         self.instrument.write(command)
+        self.invalidate_sequences()
         time.sleep(5)
 
+    def set_sequence(self, name, block):
+        """
+        name is the sequence ('Generator', 'Analyzer'), block an IEEE block from prbs_sequence().
+        """
+        if self.sequences.get(name) == block:
+            return
+        command = f":DATA:SEQuence:SET:VALue '{name}',{block}"
+        self.instrument.write(command)
+        self.sequences[name] = block
+
+    def bind_sequence(self, name, *locations):
+        if self.bindings.get(name) == locations:
+            return
+        targets = ",".join(f"'{location}'" for location in locations)
+        command = f":DATA:SEQuence:BIND '{name}',{targets}"
+        self.instrument.write(command)
+        self.bindings[name] = locations
+
+    def set_prbs(self, polynomial="2^31-1", generator_length=256, analyzer_length=128,
+                 generator="M2.DataOut", analyzers=("M1.DataIn1", "M1.DataIn2")):
+        self.set_sequence("Generator", prbs_sequence(polynomial, generator_length))
+        self.set_sequence("Analyzer", prbs_sequence(polynomial, analyzer_length, analyzer=True))
+        self.bind_sequence("Generator", generator)
+        self.bind_sequence("Analyzer", *analyzers)
+
     def set_prbs_31(self):
-        command1 = rf""":DATA:SEQuence:SET:VALue 'Generator',#3376<?xml version="1.0" encoding="utf-16"?><sequenceDefinition xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.agilent.com/schemas/M8000/DataSequence">  <description />  <sequence>    <loop>      <block length="256">        <prbs polynomial="2^31-1" />      </block>    </loop>  </sequence></sequenceDefinition>"""
-        command2 = rf""":DATA:SEQuence:SET:VALue 'Analyzer',#3371<?xml version="1.0" encoding="utf-16"?><sequenceDefinition xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.agilent.com/schemas/M8000/DataSequence">  <description />  <sequence>    <syncAndLoopBlock length="128">      <prbs polynomial="2^31-1" />    </syncAndLoopBlock>  </sequence></sequenceDefinition>"""
-        command3 = f":DATA:SEQuence:BIND 'Generator','M2.DataOut'"
-        command4 = f":DATA:SEQuence:BIND 'Analyzer','M1.DataIn1','M1.DataIn2'"
-        self.instrument.write(command1)
-        self.instrument.write(command2)
-        self.instrument.write(command3)
-        self.instrument.write(command4)
+        self.set_prbs("2^31-1")
 
     def enable_global_outputs(self):
         command = f":OUTPut:GLOBal:STATe 'M1.System',1"
@@ -1055,12 +2142,87 @@ class BERT(Instrument):
         command = f"OUTPut:EINSertion:ONCE 'M2.DataOut'"
         self.instrument.write(command)
 
+    def reset_error_counters(self, locations=("M1.DataIn1", "M1.DataIn2")):
+        for location in locations:
+            self.instrument.write(BER_RESET_COMMAND.format(location=location))
+
+    def get_error_counts(self, locations=("M1.DataIn1", "M1.DataIn2")):
+        """
+        Accumulated (bits, errors) of every analyzer input, read in one batched query.
+        """
+        queries = []
+        for location in locations:
+            queries.append(BER_BITS_QUERY.format(location=location))
+            queries.append(BER_ERRORS_QUERY.format(location=location))
+        response = self.instrument.query(";".join(queries)).split(";")
+        counts = {}
+        for i, location in enumerate(locations):
+            counts[location] = (int(float(response[2 * i])), int(float(response[2 * i + 1])))
+        return counts
+
+    def measure_ber(self, target_ber=1e-12, confidence=0.95, locations=("M1.DataIn1", "M1.DataIn2"),
+                    timeout=3600, min_interval=0.2, max_interval=10, reset=True, min_errors=None):
+        """
+        Accumulates bit and error counts on every input until each one has proven (pass) or
+        disproven (fail) BER < target_ber at the requested confidence, or until timeout (s).
+        With min_errors an input is only done once it has passed or counted min_errors errors, so a
+        BER far above target is still measured to a known precision instead of failing on one error.
+        The poll interval follows the observed bit rate: roughly half the time still needed to
+        reach a zero-error pass (or min_errors errors), bounded by min_interval and max_interval (s).
+        Returns {location: BerResult}.
+        """
+        if reset:
+            self.reset_error_counters(locations)
+        start = time.monotonic()
+        bits_needed = -math.log(1 - confidence) / target_ber
+
+        def done(bits, errors, verdict):
+            if min_errors is None:
+                return verdict != "undecided"
+            return errors >= min_errors or verdict == "pass"
+
+        def remaining_bits(bits, errors):
+            if min_errors is None or errors == 0:
+                return bits_needed - bits
+            return min(bits_needed, min_errors * bits / errors) - bits
+
+        interval = min_interval
+        last_bits = 0
+        last_time = start
+        while True:
+            time.sleep(interval)
+            counts = self.get_error_counts(locations)
+            now = time.monotonic()
+            verdicts = {location: ber_verdict(bits, errors, target_ber, confidence)
+                        for location, (bits, errors) in counts.items()}
+            if all(done(*counts[location], verdicts[location]) for location in counts) or now - start >= timeout:
+                break
+            bits = min(bits for bits, errors in counts.values())
+            if bits > last_bits and now > last_time:
+                bit_rate = (bits - last_bits) / (now - last_time)
+                remaining = max(remaining_bits(*counts[location]) for location in counts
+                                if not done(*counts[location], verdicts[location]))
+                interval = max(remaining, 0) / bit_rate / 2
+            last_bits = bits
+            last_time = now
+            interval = min(max(interval, min_interval), max_interval, max(start + timeout - now, 0))
+        results = {}
+        for location, (bits, errors) in counts.items():
+            results[location] = BerResult(bits=bits,
+                                          errors=errors,
+                                          ber=errors / bits if bits else math.nan,
+                                          ber_upper=ber_upper_bound(bits, errors, confidence),
+                                          verdict=verdicts[location],
+                                          duration=now - start)
+        return results
+
 
 def main():
     # att1 = Attenuator("GPIB0::2::INSTR")
     # print(att1.get_pset(2, 0))
     # att1.set_pset(2, 0, -9)
     # print(att1.get_pset(2, 0))
+    # print(att1.benchmark_pset(2, 0))
     # att1.close()
 
     scope = Oscilloscope("GPIB0::7::INSTR")
@@ -0,0 +1,118 @@
+"""
+Host-side analysis of captured OSA traces.
+To install numpy library, run 'pip install numpy' in command prompt or terminal
+The functions below work on a single (wavelength, amplitude) trace as returned by OSA.get_trace(),
+so a full DWDM grid is analysed in one pass without any per-channel instrument queries.
+
+Wavelengths are in nm, levels in dBm, frequencies in THz.
+"""
+
+import numpy as np   # pip install numpy
+
+SPEED_OF_LIGHT = 299792.458     # nm * THz
+
+DWDM_TABLE_DTYPE = np.dtype([("channel", "i4"),
+                             ("frequency", "f8"),
+                             ("nominal_wavelength", "f8"),
+                             ("peak_wavelength", "f8"),
+                             ("wavelength_offset", "f8"),
+                             ("power", "f8"),
+                             ("noise", "f8"),
+                             ("osnr", "f8"),
+                             ("present", "?")])
+
+
+def itu_channel_frequency(itu_channel):
+    """
+    ITU channel numbering as used by OSNR.set_itu_channel(), e.g. CH35 = 193.5 THz.
+    Half channels (35.5) give the 50 GHz grid.
+    """
+    return 190.0 + np.asarray(itu_channel, dtype=float) / 10
+
+
+def itu_grid(channels=96, spacing=50, start=191.35):
+    """
+    Returns the grid frequencies in THz.
+    spacing is in GHz, start is the first channel frequency in THz.
+    """
+    return start + np.arange(channels) * spacing / 1000
+
+
+def dwdm_grid_analysis(wavelength, amplitude, grid, resolution=None, noise_bw=0.1, threshold=-50):
+    """
+    Finds every channel of the grid in one captured trace and returns a DWDM_TABLE_DTYPE array,
+    one row per grid frequency (sorted by wavelength).
+
+    Each channel owns the part of the trace between the midpoints to its neighbours.  The peak in
+    that window is the channel power, and the noise under the peak is linearly interpolated (in mW)
+    between the trace levels at the two window edges.  OSNR is signal over noise, with the noise
+    referred from the resolution bandwidth to noise_bw (both in nm) when resolution is given.
+    Channels whose peak is below threshold (dBm), or whose window is cut off by the trace edges,
+    are flagged as not present and carry NaN.
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    amplitude = np.asarray(amplitude, dtype=float)
+    order = np.argsort(wavelength)
+    wavelength = wavelength[order]
+    amplitude = amplitude[order]
+
+    frequency = np.sort(np.asarray(grid, dtype=float))[::-1]
+    nominal = SPEED_OF_LIGHT / frequency
+    channels = len(nominal)
+
+    # Window edges: midpoints between channels, outer edges mirrored by half a spacing
+    if channels > 1:
+        midpoints = (nominal[1:] + nominal[:-1]) / 2
+        first_edge = nominal[0] - (midpoints[0] - nominal[0])
+        last_edge = nominal[-1] + (nominal[-1] - midpoints[-1])
+    else:
+        midpoints = np.empty(0)
+        first_edge = wavelength[0]
+        last_edge = wavelength[-1]
+    edges = np.concatenate(([first_edge], midpoints, [last_edge]))
+    edge_index = np.searchsorted(wavelength, edges)
+    start = edge_index[:-1]
+    stop = edge_index[1:]
+    # Channels whose window is not fully inside the captured span cannot be trusted
+    populated = (stop > start) & (edges[:-1] >= wavelength[0]) & (edges[1:] <= wavelength[-1])
+
+    # Peak level per window in one reduceat, then the first sample reaching it
+    in_span = amplitude[:edge_index[-1]]
+    if len(in_span) == 0:
+        in_span = np.full(1, np.nan)
+    peak_level = np.maximum.reduceat(in_span, np.minimum(start, len(in_span) - 1))
+    peak_level[~populated] = np.nan
+    window = np.searchsorted(stop, np.arange(len(amplitude)), side="right")
+    in_grid = (window < channels) & (np.arange(len(amplitude)) >= edge_index[0])
+    sample_window = np.where(in_grid, window, 0)
+    is_peak = in_grid & (amplitude == peak_level[sample_window])
+    peak_windows, first_peak = np.unique(window[is_peak], return_index=True)
+    peak_index = np.zeros(channels, dtype=int)
+    peak_index[peak_windows] = np.flatnonzero(is_peak)[first_peak]
+    peak_wavelength = wavelength[peak_index]
+
+    # Noise interpolated between the window edges under each peak
+    edge_noise = 10 ** (np.interp(edges, wavelength, amplitude) / 10)
+    fraction = (peak_wavelength - edges[:-1]) / (edges[1:] - edges[:-1])
+    noise_mw = edge_noise[:-1] + fraction * (edge_noise[1:] - edge_noise[:-1])
+    signal_mw = 10 ** (peak_level / 10) - noise_mw
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        osnr = 10 * np.log10(signal_mw / noise_mw)
+        if resolution:
+            osnr -= 10 * np.log10(noise_bw / float(resolution))
+        noise = 10 * np.log10(noise_mw)
+
+    present = populated & (peak_level >= threshold)
+
+    table = np.zeros(channels, dtype=DWDM_TABLE_DTYPE)
+    table["channel"] = np.arange(1, channels + 1)
+    table["frequency"] = frequency
+    table["nominal_wavelength"] = nominal
+    table["peak_wavelength"] = np.where(present, peak_wavelength, np.nan)
+    table["wavelength_offset"] = np.where(present, peak_wavelength - nominal, np.nan)
+    table["power"] = np.where(present, peak_level, np.nan)
+    table["noise"] = np.where(present, noise, np.nan)
+    table["osnr"] = np.where(present, osnr, np.nan)
+    table["present"] = present
+    return table
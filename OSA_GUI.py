@@ -33,6 +33,7 @@ class MainWindow(QMainWindow):
 
         self.analysis_labels = None
         self.analysis_data = None
+        self.analysis_generation = None
 
         self.figure = plt.figure()
         self.canvas = FigureCanvas(self.figure)
@@ -72,7 +73,7 @@ class MainWindow(QMainWindow):
             self.layout.addWidget(self.canvas, 1, 0, 1, 3)
 
             self.refresh_button = QPushButton("Refresh Screen")
-            self.refresh_button.clicked.connect(self.fetch_screen)
+            self.refresh_button.clicked.connect(self.refresh_screen)
 
             self.autoscale_button = QPushButton("Auto")
             self.autoscale_button.clicked.connect(self.auto_sweep)
@@ -153,7 +154,7 @@ class MainWindow(QMainWindow):
             self.analysis_label = QLabel("Analysis:")
             self.analysis_label.setStyleSheet("font-weight: bold;")
             self.analysis_button = QPushButton("Refresh Values")
-            self.analysis_button.clicked.connect(self.analysis)
+            self.analysis_button.clicked.connect(self.refresh_values)
             self.button_layout2.addWidget(QLabel(" "), 1, 0)
             self.button_layout2.addWidget(self.analysis_label, 2, 0)
             self.button_layout2.addWidget(self.analysis_button, 2, 2)
@@ -233,7 +234,7 @@ class MainWindow(QMainWindow):
     def single_sweep(self):
         try:
             self.osa_instrument.single_sweep()
-            time.sleep(3)
+            self.osa_instrument.wait_for_sweep(timeout=30)
             self.fetch_screen()
         except:
             self.raise_connection_error()
@@ -247,28 +248,33 @@ class MainWindow(QMainWindow):
 
     def analysis(self):
         try:
+            # Same sweep as the values already on screen, nothing to re-query
+            if (self.analysis_generation == self.osa_instrument.sweep_generation
+                    and not self.osa_instrument.repeating and not self.osa_instrument.sweeping):
+                return
+
             self.osa_instrument.clear()
             self.osa_instrument.set_wdm_mode()
             time.sleep(0.1)
             try:
                 wdm_data = self.osa_instrument.get_osnr_values()
                 if len(wdm_data) != 4:
-                    wdm_data = self.osa_instrument.get_osnr_values()
+                    wdm_data = self.osa_instrument.get_osnr_values(refresh=True)
             except:
                 wdm_data = self.osa_instrument.get_osnr_values()
                 if len(wdm_data) != 4:
-                    wdm_data = self.osa_instrument.get_osnr_values()
+                    wdm_data = self.osa_instrument.get_osnr_values(refresh=True)
 
             self.osa_instrument.set_smsr_mode()
             time.sleep(0.1)
             try:
                 smsr_data = self.osa_instrument.get_smsr_values()
                 if len(smsr_data) != 6:
-                    smsr_data = self.osa_instrument.get_smsr_values()
+                    smsr_data = self.osa_instrument.get_smsr_values(refresh=True)
             except:
                 smsr_data = self.osa_instrument.get_smsr_values()
                 if len(smsr_data) != 6:
-                    smsr_data = self.osa_instrument.get_smsr_values()
+                    smsr_data = self.osa_instrument.get_smsr_values(refresh=True)
 
 
             try:
@@ -327,6 +333,7 @@ class MainWindow(QMainWindow):
             self.params_labels.addWidget(self.resolution_label)
             self.params_labels.addWidget(self.nbw_label)
             self.button_layout2.addLayout(self.params_labels, 3, 2)
+            self.analysis_generation = self.osa_instrument.sweep_generation
         
         except:
             self.raise_connection_error()
@@ -387,16 +394,25 @@ class MainWindow(QMainWindow):
             except:
                 pass
             self.osa_instrument = None
+            self.analysis_generation = None
             # self.resize(1, 1)
 
+    # Refresh buttons re-read the instrument, e.g. after front-panel changes
+    def refresh_screen(self):
+        if self.osa_instrument:
+            self.osa_instrument.bump_generation()
+        self.fetch_screen()
+
+    def refresh_values(self):
+        if self.osa_instrument:
+            self.osa_instrument.bump_generation()
+        self.analysis()
+
     def fetch_screen(self):
         try:
             if self.osa_instrument:
                 self.figure.clear()
-                amplitude = self.osa_instrument.instrument.query("LDATA").replace(" ", "").split(",")[1:]
-                wavelength = self.osa_instrument.instrument.query("WDATA").replace(" ", "").split(",")[1:]
-                amplitude = [float(val) for val in amplitude]
-                wavelength = [float(val) for val in wavelength]
+                wavelength, amplitude = self.osa_instrument.get_trace()
 
                 plt.plot(wavelength, amplitude)
                 plt.xlabel('Wavelength (nm)')
@@ -431,6 +447,9 @@ class Instrument:
     class UnknownInstrumentError(Exception):
         pass
 
+    class TimeoutError(Exception):
+        pass
+
     def __init__(self, address=None, nickname="Instrument"):
         self.address = address
         self.nickname = nickname
@@ -482,8 +501,39 @@ class Instrument:
 class OSA(Instrument):
 
     def __init__(self, address=None, nickname="OSA"):
+        self.sweep_generation = 0
+        self.sweep_cache = {}
+        self.repeating = False
+        self.sweeping = False
         super().__init__(address, nickname)
 
+    # Invalidate memoised reads after a sweep or setting change
+    def bump_generation(self):
+        self.sweep_generation += 1
+        self.sweep_cache = {}
+
+    # Return the memoised result of func for the current sweep generation, refresh re-reads it
+    # Nothing is memoised until a single/auto sweep has finished
+    def cached_read(self, key, func, refresh=False):
+        if self.repeating or (self.sweeping and not self.sweep_finished()):
+            return func()
+        if refresh or key not in self.sweep_cache:
+            self.sweep_cache[key] = func()
+        return self.sweep_cache[key]
+
+    # SWEEP? returns 0 once the sweep has stopped
+    def sweep_finished(self):
+        if self.instrument.query("SWEEP?").strip() == "0":
+            self.sweeping = False
+        return not self.sweeping
+
+    def wait_for_sweep(self, timeout=60, poll_interval=0.5):
+        deadline = time.monotonic() + timeout
+        while not self.sweep_finished():
+            if time.monotonic() > deadline:
+                raise Instrument.TimeoutError(f"Sweep did not finish within {timeout} s")
+            time.sleep(poll_interval)
+
     # Check if it's in AQ6317 Compatible Mode
     def command_mode(self):
         command2 = ":SYSTem:COMMunicate:CFORmat AQ6317"
@@ -498,42 +548,60 @@ class OSA(Instrument):
     def auto_sweep(self):
         command = "AUTO"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = True
+        self.bump_generation()
 
     def repeat_sweep(self):
         command = "RPT"
         self.instrument.write(command)
+        self.repeating = True
+        self.sweeping = False
+        self.bump_generation()
 
     def single_sweep(self):
         command = "SGL"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = True
+        self.bump_generation()
 
     def stop_sweep(self):
         command = "STP"
         self.instrument.write(command)
+        self.repeating = False
+        self.sweeping = False
+        self.bump_generation()
 
     def set_center(self, wl):
         command = f"CTRWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_start(self, wl):
         command = f"STAWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_stop(self, wl):
         command = f"STPWL{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_span(self, wl):
         command = f"SPAN{wl}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_resolution(self, rsln):
         command = f"RESLN{rsln}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_noise_bw(self, nbw):
         command = f"WDMNOIBW{nbw}"
         self.instrument.write(command)
+        self.bump_generation()
 
     def set_smsr_mode(self):
         command = f"SMSR1"
@@ -543,14 +611,22 @@ class OSA(Instrument):
         command = f"WDMAN"
         self.instrument.write(command)
 
-    def get_osnr_values(self):
+    def get_osnr_values(self, refresh=False):
+        response = self.cached_read("WDM ANA?", self.query_osnr_values, refresh)
+        return list(response)
+
+    def query_osnr_values(self):
         self.set_wdm_mode()
         command = "ANA?"
         response = self.instrument.query(command).replace(
             " ", "").replace("\r", "").replace("\n", "").split(",")
         return response
 
-    def get_smsr_values(self):
+    def get_smsr_values(self, refresh=False):
+        response = self.cached_read("SMSR ANA?", self.query_smsr_values, refresh)
+        return list(response)
+
+    def query_smsr_values(self):
         self.set_smsr_mode()
         command = "ANA?"
         response = self.instrument.query(command).replace(" ", "").replace("\n", "").split(",")
@@ -559,18 +635,29 @@ class OSA(Instrument):
 
     def get_span(self):
         command = "SPAN?"
-        response = (self.instrument.query(command)).replace("\n", "")
+        response = self.cached_read(command, lambda: self.instrument.query(command).replace("\n", ""))
         return response
 
     def get_resolution(self):
         command = "RESLN?"
-        response = (self.instrument.query(command)).replace("\n", "")
+        response = self.cached_read(command, lambda: self.instrument.query(command).replace("\n", ""))
         return response
     
     def get_noise_bw(self):
         command = "WDMNOIBW?"
-        response = (self.instrument.query(command)).replace("\n", "")
+        response = self.cached_read(command, lambda: self.instrument.query(command).replace("\n", ""))
         return response
 
+    def get_trace(self, refresh=False):
+        wavelength, amplitude = self.cached_read("TRACE", self.query_trace, refresh)
+        return list(wavelength), list(amplitude)
+
+    def query_trace(self):
+        amplitude = self.instrument.query("LDATA").replace(" ", "").split(",")[1:]
+        wavelength = self.instrument.query("WDATA").replace(" ", "").split(",")[1:]
+        amplitude = [float(val) for val in amplitude]
+        wavelength = [float(val) for val in wavelength]
+        return wavelength, amplitude
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+"""
+Host-side trace arithmetic for captured OSA traces.
+To install numpy library, run 'pip install numpy' in command prompt or terminal
+Every class here is fed one sweep at a time through update(), so streamed sweeps are processed
+incrementally with fixed memory and without re-processing history.  Levels are in dBm / dB.
+
+Example:
+    average = TraceAverage(count=16)
+    hold = MaxHold()
+    for i in range(100):
+        osa.single_sweep()
+        wavelength, amplitude = osa.get_trace()
+        average.update(amplitude)
+        hold.update(amplitude)
+    loss = subtract_reference(average.result(), reference)
+"""
+
+import numpy as np   # pip install numpy
+
+
+def db_to_linear(level):
+    return 10 ** (np.asarray(level, dtype=float) / 10)
+
+
+def linear_to_db(power):
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(power)
+
+
+class TraceAverage:
+    """
+    Running average of streamed sweeps.
+    count=None averages every sweep seen so far (one accumulator).
+    count=N averages the last N sweeps (ring buffer of N sweeps plus a running sum).
+    Averaging is done on linear power unless linear=False, in which case dB values are averaged.
+    """
+
+    def __init__(self, count=None, linear=True):
+        self.count = count
+        self.linear = linear
+        self.reset()
+
+    def reset(self):
+        self.total = None
+        self.history = None
+        self.position = 0
+        self.sweeps = 0
+
+    def update(self, amplitude):
+        sweep = db_to_linear(amplitude) if self.linear else np.array(amplitude, dtype=float)
+        if self.total is None:
+            self.total = np.zeros_like(sweep)
+            if self.count:
+                self.history = np.zeros((self.count, len(sweep)))
+        elif len(sweep) != len(self.total):
+            raise ValueError("Sweep length changed, reset() the average first.")
+        if self.count:
+            # Drop the oldest sweep from the running sum once the window is full
+            if self.sweeps >= self.count:
+                self.total -= self.history[self.position]
+            self.history[self.position] = sweep
+            self.position = (self.position + 1) % self.count
+        self.total += sweep
+        self.sweeps += 1
+        return self.result()
+
+    def result(self):
+        if self.total is None:
+            return None
+        n = min(self.sweeps, self.count) if self.count else self.sweeps
+        mean = self.total / n
+        return linear_to_db(mean) if self.linear else mean
+
+
+class MaxHold:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hold = None
+
+    def update(self, amplitude):
+        sweep = np.asarray(amplitude, dtype=float)
+        if self.hold is None:
+            self.hold = sweep.copy()
+        else:
+            np.maximum(self.hold, sweep, out=self.hold)
+        return self.hold
+
+    def result(self):
+        return self.hold
+
+
+class MinHold(MaxHold):
+
+    def update(self, amplitude):
+        sweep = np.asarray(amplitude, dtype=float)
+        if self.hold is None:
+            self.hold = sweep.copy()
+        else:
+            np.minimum(self.hold, sweep, out=self.hold)
+        return self.hold
+
+
+def subtract_reference(amplitude, reference):
+    """
+    dB-domain subtraction, e.g. DUT trace minus a stored source trace gives insertion loss/gain.
+    """
+    return np.asarray(amplitude, dtype=float) - np.asarray(reference, dtype=float)
+
+
+def normalise(amplitude, level=None):
+    """
+    Shifts the trace so that level (default: the trace peak) sits at 0 dB.
+    """
+    amplitude = np.asarray(amplitude, dtype=float)
+    if level is None:
+        level = np.nanmax(amplitude)
+    return amplitude - level
+
+
+class ReferenceTrace:
+    """
+    Stores a reference trace (optionally averaged over several sweeps) and subtracts it from
+    each streamed sweep.
+    """
+
+    def __init__(self, reference=None):
+        self.reference = None if reference is None else np.array(reference, dtype=float)
+
+    def store(self, amplitude):
+        self.reference = np.array(amplitude, dtype=float)
+
+    def update(self, amplitude):
+        if self.reference is None:
+            raise ValueError("No reference trace stored.")
+        return subtract_reference(amplitude, self.reference)
@@ -0,0 +1,91 @@
+"""
+Closed-loop OSNR setpoint search using the OSNR generator and the OSA.
+OSNR.set_osnr() is driven from the OSNR the OSA actually measures (OSA.get_osnr()) with a secant
+search that falls back to bisection once the target is bracketed.  The measured-minus-set offset
+of the last search seeds the next one, so later targets usually converge in one or two sweeps.
+
+Example:
+    controller = OSNRController(osnr, osa)
+    result = controller.reach(20, tolerance=0.1)
+    print(result.setpoint, result.osnr, result.iterations)
+"""
+
+import math
+from collections import namedtuple
+from Instruments import IO_CONTROL, Instrument, IOScheduler
+
+OSNRControlResult = namedtuple("OSNRControlResult", ["setpoint", "osnr", "iterations", "converged", "history"])
+
+
+class OSNRController:
+    """
+    The analysis is read once OSA.wait_for_sweep() reports the sweep finished, within sweep_timeout (s).
+    Setpoints are kept within [min_setpoint, max_setpoint] dB.
+    """
+
+    def __init__(self, osnr, osa, sweep_timeout=60, min_setpoint=0, max_setpoint=40):
+        self.osnr = osnr
+        self.osa = osa
+        self.sweep_timeout = sweep_timeout
+        self.min_setpoint = min_setpoint
+        self.max_setpoint = max_setpoint
+        self.offset = 0
+
+    def measure(self, setpoint):
+        self.osnr.set_osnr(round(setpoint, 2))
+        self.osa.single_sweep()
+        self.osa.wait_for_sweep(self.sweep_timeout)
+        return float(self.osa.get_osnr())
+
+    def clamp(self, setpoint):
+        return min(max(setpoint, self.min_setpoint), self.max_setpoint)
+
+    @IOScheduler.priority(IO_CONTROL)
+    def reach(self, target, tolerance=0.1, max_iterations=8):
+        """
+        Returns an OSNRControlResult; history holds every (setpoint, measured OSNR) pair.
+        An iteration whose sweep times out is not used and the setpoint is swept again.
+        """
+        history = []
+        setpoint = self.clamp(target - self.offset)
+        below = None    # (setpoint, error) with measured OSNR under target
+        above = None    # (setpoint, error) with measured OSNR over target
+        for iteration in range(1, max_iterations + 1):
+            try:
+                measured = self.measure(setpoint)
+            except Instrument.TimeoutError:
+                continue
+            history.append((setpoint, measured))
+            error = measured - target
+            self.offset = measured - setpoint
+            if abs(error) <= tolerance:
+                return OSNRControlResult(setpoint, measured, iteration, True, history)
+            if error < 0:
+                below = (setpoint, error)
+            else:
+                above = (setpoint, error)
+
+            # Secant step from the last two points, unit slope until there are two
+            slope = 1.0
+            if len(history) > 1:
+                (previous_setpoint, previous_measured), (last_setpoint, last_measured) = history[-2:]
+                if last_setpoint != previous_setpoint:
+                    slope = (last_measured - previous_measured) / (last_setpoint - previous_setpoint)
+                if slope <= 0.1:
+                    slope = 1.0
+            next_setpoint = setpoint - error / slope
+
+            # Bisect when the secant step leaves the bracket
+            if below is not None and above is not None:
+                low, high = sorted((below[0], above[0]))
+                if not low < next_setpoint < high:
+                    next_setpoint = (below[0] + above[0]) / 2
+            next_setpoint = self.clamp(next_setpoint)
+            if next_setpoint == setpoint:
+                break
+            setpoint = next_setpoint
+        if history:
+            setpoint, measured = history[-1]
+        else:
+            measured = math.nan
+        return OSNRControlResult(setpoint, measured, iteration, False, history)
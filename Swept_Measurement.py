@@ -0,0 +1,82 @@
+"""
+Swept-wavelength insertion loss with a Tunable_Laser and a PowerMeter in the same 816x mainframe.
+To install numpy library, run 'pip install numpy' in command prompt or terminal
+The laser runs one continuous sweep and sends a trigger every step, the power meter logs one
+reading per trigger, and both logs (lambda logging and power logging) are read back as single
+binary blocks.  Thousands of points take the sweep time plus two transfers instead of a GPIB
+round-trip and settle per point.
+
+Example:
+    il = SweptInsertionLoss(laser, 1, meter, 2)
+    il.reference(1520, 1570, 0.01)          # without DUT
+    wavelength, loss = il.insertion_loss()  # with DUT
+"""
+
+import numpy as np   # pip install numpy
+
+
+class SweptInsertionLoss:
+    """
+    laser and meter are the Tunable_Laser and PowerMeter instances (usually the same mainframe),
+    laser_slot / meter_slot / meter_channel locate the modules.
+    """
+
+    def __init__(self, laser, laser_slot, meter, meter_slot, meter_channel=1, speed=10, power=None):
+        self.laser = laser
+        self.laser_slot = laser_slot
+        self.meter = meter
+        self.meter_slot = meter_slot
+        self.meter_channel = meter_channel
+        self.speed = speed
+        self.power = power
+        self.sweep = None
+        self.reference_power = None
+
+    def measure(self, start=None, stop=None, step=None):
+        """
+        One triggered sweep.  start/stop/step (nm) default to the last sweep's settings.
+        Returns (wavelength nm, power dBm) numpy arrays aligned point by point.
+        """
+        if start is not None:
+            self.sweep = (start, stop, step)
+        start, stop, step = self.sweep
+        slot = self.laser_slot
+        if self.power is not None:
+            self.laser.set_power(slot, self.power)
+        self.laser.configure_sweep(slot, start, stop, step, self.speed)
+        points = self.laser.get_sweep_points(slot)
+
+        # Laser trigger output is looped back to the meter's trigger input inside the mainframe
+        self.meter.set_trigger_loopback()
+        self.meter.configure_logging(self.meter_slot, points, step / self.speed / 2)
+        self.meter.start_logging(self.meter_slot)
+        self.laser.start_sweep(slot)
+        sweep_time = (stop - start) / self.speed
+        self.laser.wait_for_sweep(slot, timeout=sweep_time * 2 + 30)
+        self.meter.wait_for_logging(self.meter_slot, timeout=30)
+
+        wavelength = self.laser.get_sweep_wavelengths(slot)
+        watts = self.meter.get_logging_result(self.meter_slot, self.meter_channel)
+        points = min(len(wavelength), len(watts))
+        with np.errstate(divide="ignore"):
+            power = 10 * np.log10(watts[:points] * 1000)
+        return wavelength[:points], power
+
+    def reference(self, start, stop, step):
+        """
+        Stores a reference sweep (no DUT) for insertion_loss().
+        """
+        wavelength, power = self.measure(start, stop, step)
+        self.reference_power = (wavelength, power)
+        return wavelength, power
+
+    def insertion_loss(self):
+        """
+        Sweeps with the DUT and returns (wavelength nm, insertion loss dB), the reference
+        interpolated onto the measured wavelengths.
+        """
+        if self.reference_power is None:
+            raise ValueError("Take a reference() sweep first.")
+        wavelength, power = self.measure()
+        reference_wavelength, reference_power = self.reference_power
+        return wavelength, np.interp(wavelength, reference_wavelength, reference_power) - power
@@ -0,0 +1,115 @@
+"""
+Routing planner for a Polatis switch shared between many DUTs and a few instruments.
+Measurement jobs each need a set of crossconnects ({input: output}).  The planner packs jobs whose
+connections do not conflict into one switch configuration, then orders the configurations so each
+step changes as few connections as possible.  Every reconfiguration is applied with
+Polatis_Switch.apply_connection_map(), i.e. at most one conn:sub and one conn:add command.
+
+Example:
+    planner = SwitchPlanner(switch, settle_time=0.05)
+    jobs = [SwitchJob("DUT1 OSA", {1: 17}, 2.0, measure_osa_dut1),
+            SwitchJob("DUT2 scope", {2: 18}, 5.0, measure_scope_dut2),
+            SwitchJob("DUT2 OSA", {2: 17}, 2.0, measure_osa_dut2)]
+    schedule = planner.plan(jobs)
+    print(planner.estimated_time(schedule))
+    planner.run(schedule)
+"""
+
+import time
+from collections import namedtuple
+from Instruments import Polatis_Switch
+
+SwitchJob = namedtuple("SwitchJob", ["name", "connections", "duration", "action"], defaults=[0, None])
+SwitchStep = namedtuple("SwitchStep", ["connections", "jobs", "remove", "add", "switch_time"])
+
+
+def compatible(configuration, connections):
+    used_outputs = {output: input for input, output in configuration.items()}
+    for input, output in connections.items():
+        if configuration.get(input, output) != output:
+            return False
+        if used_outputs.get(output, input) != input:
+            return False
+    return True
+
+
+class SwitchPlanner:
+    """
+    switch is a Polatis_Switch (or None to plan offline).
+    settle_time (s) is the optical settle wait after every reconfiguration, command_time (s) the
+    cost of one switch command.  Both feed the schedule's estimated time.
+    """
+
+    def __init__(self, switch=None, settle_time=0.05, command_time=0.02, max_ports=64):
+        self.switch = switch
+        self.settle_time = settle_time
+        self.command_time = command_time
+        self.max_ports = max_ports
+
+    def switch_cost(self, remove, add):
+        if not remove and not add:
+            return 0
+        commands = -(-len(remove) // self.max_ports) + -(-len(add) // self.max_ports)
+        return commands * self.command_time + self.settle_time
+
+    def group(self, jobs):
+        """
+        First-fit packing of jobs into conflict-free configurations.
+        Returns a list of (configuration, jobs).
+        """
+        groups = []
+        ordered = sorted(jobs, key=lambda job: sorted(job.connections.items()))
+        for job in ordered:
+            for configuration, members in groups:
+                if compatible(configuration, job.connections):
+                    configuration.update(job.connections)
+                    members.append(job)
+                    break
+            else:
+                groups.append((dict(job.connections), [job]))
+        return groups
+
+    def plan(self, jobs, current=None):
+        """
+        Orders the job groups greedily, always moving to the configuration that needs the fewest
+        connection changes from the present switch state.  current defaults to the switch's
+        connection map (empty when planning offline).  Returns a list of SwitchStep.
+        """
+        if current is None:
+            current = self.switch.get_connection_map() if self.switch else {}
+        state = dict(current)
+        remaining = self.group(jobs)
+        schedule = []
+        while remaining:
+            costs = [Polatis_Switch.connection_diff(state, configuration) for configuration, members in remaining]
+            best = min(range(len(remaining)), key=lambda i: len(costs[i][0]) + len(costs[i][1]))
+            configuration, members = remaining.pop(best)
+            remove, add = costs[best]
+            schedule.append(SwitchStep(configuration, members, remove, add, self.switch_cost(remove, add)))
+            for input, output in remove:
+                del state[input]
+            state.update(add)
+        return schedule
+
+    def estimated_time(self, schedule):
+        """
+        Estimated run time (s): switching and settling plus the jobs' own durations.
+        """
+        return sum(step.switch_time + sum(job.duration for job in step.jobs) for step in schedule)
+
+    def reconfigurations(self, schedule):
+        return sum(1 for step in schedule if step.remove or step.add)
+
+    def run(self, schedule):
+        """
+        Applies each step and runs its jobs' actions.  Returns {job name: action result}.
+        """
+        results = {}
+        for step in schedule:
+            if step.remove or step.add:
+                self.switch.apply_connection_map(step.connections, max_ports=self.max_ports)
+                time.sleep(self.settle_time)
+            for job in step.jobs:
+                if job.action is not None:
+                    results[job.name] = job.action()
+        return results